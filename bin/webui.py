@@ -16,6 +16,8 @@ assert sys.version_info[0] == 2 and sys.version_info[1] >= 6, \
 
 import thor
 from redbot import __version__
+from redbot.resource import HttpResource
+from redbot.resource.fetch import RedFetcher
 from redbot.resource.robot_fetch import RobotFetcher
 from redbot.formatter import html
 from redbot.webui import RedWebUi, except_handler_factory
@@ -58,6 +60,21 @@ class Config(object):
 # Where to cache robots.txt
 RobotFetcher.robot_cache_dir = "/var/state/robots-txt/" if not Config.debug else False
 
+# how many linked resources to check when descending
+HttpResource.max_linked = 100
+
+# start subrequests that only need the response headers before the body is done
+HttpResource.pipeline_checks = True
+
+# how many connections to open to an origin at once, shared by all of the checks in a process
+RedFetcher.client.max_server_conn = 16
+
+# how much of each response body to read, in bytes; None to disable
+RedFetcher.max_payload = 1024 * 1024 * 16
+
+# stop a check once it's transferred this many bytes (including linked resources); None to disable
+HttpResource.max_transfer = 1024 * 1024 * 64
+
 # directory containing files to append to the front page; None to disable
 html.extra_dir = "extra"
 
@@ -55,12 +55,12 @@ class HarFormatter(Formatter):
 
     def finish_output(self):
         "Fill in the template with RED's results."
-        if self.state.response.complete:
+        if self.state.response.complete or self.state.response.truncated:
             page_id = self.add_page(self.state)
             self.add_entry(self.state, page_id)
             for linked_state in [d[0] for d in self.state.linked]:
                 # filter out incomplete responses
-                if linked_state.response.complete:
+                if linked_state.response.complete or linked_state.response.truncated:
                     self.add_entry(linked_state, page_id)
         self.output(json.dumps(self.har, indent=4))
         self.done()
@@ -69,7 +69,8 @@ class HarFormatter(Formatter):
         entry = {
             "startedDateTime": isoformat(state.request.start_time),
             "time": int((state.response.complete_time - state.request.start_time) * 1000),
-            "_red_messages": self.format_notes(state)
+            "_red_messages": self.format_notes(state),
+            "_red_conn_reused": state.response.conn_reused,
         }
         if page_ref:
             entry['pageref'] = "page%s" % page_ref
@@ -18,7 +18,6 @@ from functools import partial
 from urlparse import urljoin
 e_html = partial(e_html, quote=True)
 
-from markdown import markdown
 
 import thor
 import thor.http.error as httperr
@@ -288,7 +287,7 @@ class SingleEntryHtmlFormatter(BaseHtmlFormatter):
 
     def finish_output(self):
         self.final_status()
-        if self.state.response.complete:
+        if self.state.response.complete or self.state.response.truncated:
             self.header_presenter = HeaderPresenter(self)
             self.output(self.template % {
                 'response': self.format_response(self.state),
@@ -331,6 +330,7 @@ class SingleEntryHtmlFormatter(BaseHtmlFormatter):
         token_name = "header-%s" % name.lower()
         header_desc = HeaderProcessor.find_header_handler(name).description
         if header_desc and token_name not in [i[0] for i in self.hidden_text]:
+            from markdown import markdown # it's slow to import; see Note.show_text.
             html_desc = markdown(header_desc % {'field_name': name}, output_format="html5")
             self.hidden_text.append((token_name, html_desc))
         return u"""\
@@ -450,6 +450,11 @@ class SingleEntryHtmlFormatter(BaseHtmlFormatter):
                     u"<a href='?descend=True&%s' accesskey='a'>" \
                     u"check embedded</a>" % self.req_qs(use_stored=False),
                     "run RED on images, frames and embedded links"))
+                options.append((
+                    u"<a href='?descend=True&light=True&%s'>" \
+                    u"quick check embedded</a>" % self.req_qs(use_stored=False),
+                    "run RED on images, frames and embedded links, " \
+                    "without checking validation, compression or partial content"))
         return nl.join(
             [o and u"<span class='option' title='%s'>%s</span>" % (o[1], o[0])
              or u"<br>" for o in options])
@@ -556,8 +561,24 @@ class TableHtmlFormatter(BaseHtmlFormatter):
                 droids.sort(key=operator.attrgetter('response.base_uri'))
                 out.append(self.format_table_header(heading + u" (%s)" % len(droids)))
                 out += [self.format_droid(d) for d in droids]
+        if state.skipped_links:
+            out.append(self.format_table_header(
+                u"Skipped Links (%s)" % len(state.skipped_links)))
+            out += [self.format_skipped(uri, tag) for uri, tag in state.skipped_links]
         return nl.join(out)
 
+    def format_skipped(self, uri, tag):
+        "Format a link that wasn't checked because there were too many."
+        return u"""\
+    <tr class="droid">
+    <td class="uri"><a href="%s" title="%s">%s</a></td>
+    <td colspan="11">not checked (%s); too many links</td>
+    </tr>""" % (
+        u"?%s" % self.req_qs(uri, use_stored=False),
+        e_html(uri),
+        e_html(uri),
+        e_html(tag))
+
     def format_droid(self, state):
         out = [u'<tr class="droid %s">']
         m = 50
@@ -586,7 +607,7 @@ class TableHtmlFormatter(BaseHtmlFormatter):
                     e_html(state.request.uri),
                     cl,
                     e_html(state.request.uri)))
-        if state.response.complete:
+        if state.response.complete or state.response.truncated:
             if state.response.status_code in ['301', '302', '303', '307', '308'] and \
               state.response.parsed_headers.has_key('location'):
                 out.append(
@@ -59,7 +59,7 @@ class BaseTextFormatter(Formatter):
 
     def finish_output(self):
         "Fill in the template with RED's results."
-        if self.state.response.complete:
+        if self.state.response.complete or self.state.response.truncated:
             self.output(self.format_headers(self.state) + nl + nl)
             self.output(self.format_recommendations(self.state) + nl)
         else:
@@ -179,11 +179,17 @@ class TextListFormatter(BaseTextFormatter):
                 sep, heading, len(droids), sep
             ))
             if droids:
-                droids.sort(key=operator.attrgetter('uri'))
+                droids.sort(key=operator.attrgetter('request.uri'))
                 for droid in droids:
                     self.output(self.format_uri(droid) + nl + nl)
                     self.output(self.format_headers(droid) + nl + nl)
                     self.output(self.format_recommendations(droid) + nl + nl)
+        if self.state.skipped_links:
+            self.output("%s\nSkipped Links (%d)\n%s\n" % (
+                sep, len(self.state.skipped_links), sep
+            ))
+            for uri, tag in self.state.skipped_links:
+                self.output(u"%s (%s)" % (self.colorize("uri", uri), tag) + nl)
         self.done()
 
     def format_uri(self, state):
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+"""
+Bounded, least-recently-used caches.
+"""
+
+import time
+import unittest
+
+
+class LruCache(object):
+    """
+    A cache that keeps no more than max_size items. When there's no more room, the least
+    recently used evict_fraction of them are forgotten at once, so that the cost of keeping
+    track of use stays small.
+
+    get() counts hits and misses (and _evict, evictions), so that the cache's effectiveness
+    can be seen.
+    """
+    evict_fraction = 0.25
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = {} # key: [value, when last used]
+        self._clock = 0
+
+    def get(self, key, default=None):
+        "Return the value for key (making it the most recently used), or default."
+        item = self._items.get(key, None)
+        if item is None:
+            self.misses += 1
+            return default
+        self._clock += 1
+        item[1] = self._clock
+        self.hits += 1
+        return item[0]
+
+    def __setitem__(self, key, value):
+        self._clock += 1
+        self._items[key] = [value, self._clock]
+        if len(self._items) > self.max_size:
+            self._evict()
+
+    def _evict(self):
+        "Forget the least recently used items."
+        count = max(1, int(self.max_size * self.evict_fraction))
+        by_use = sorted(self._items.iteritems(), key=lambda (key, item): item[1])
+        for key, item in by_use[:count]:
+            del self._items[key]
+        self.evictions += count
+
+    def __delitem__(self, key):
+        del self._items[key]
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        "Forget everything, but not the counts."
+        self._items.clear()
+
+
+class ExpiringLruCache(LruCache):
+    """
+    An LruCache whose items expire, and which also keeps their total (approximate) size
+    under max_total_size.
+
+    Items are added with set(), which takes the time that they expire (in seconds since the
+    epoch) and their size. Expired items are never returned; get() forgets them and counts
+    them in expirations.
+    """
+
+    def __init__(self, max_size, max_total_size):
+        LruCache.__init__(self, max_size)
+        self.max_total_size = max_total_size
+        self.total_size = 0
+        self.expirations = 0
+
+    def get(self, key, default=None, now=None):
+        """
+        Return the value for key (making it the most recently used), or default if it isn't
+        there or has expired as of now (default: the current time).
+        """
+        item = self._items.get(key, None)
+        if item is not None and item[2] <= (now or time.time()):
+            self._forget(key)
+            self.expirations += 1
+            item = None
+        if item is None:
+            self.misses += 1
+            return default
+        self._clock += 1
+        item[1] = self._clock
+        self.hits += 1
+        return item[0]
+
+    def set(self, key, value, expires, size=1):
+        "Add value for key until expires, with the given size."
+        if key in self._items:
+            self._forget(key)
+        self._clock += 1
+        self._items[key] = [value, self._clock, expires, size]
+        self.total_size += size
+        if len(self._items) > self.max_size or self.total_size > self.max_total_size:
+            self._evict()
+
+    def __setitem__(self, key, value):
+        self.set(key, value, float('inf'))
+
+    # _items is {key: [value, when last used, when it expires, size]}
+
+    def _evict(self):
+        """
+        Forget expired items, and then the least recently used ones until there's
+        evict_fraction room (by number and size).
+        """
+        now = time.time()
+        for key, item in self._items.items():
+            if item[2] <= now:
+                self._forget(key)
+                self.expirations += 1
+        max_size = self.max_size - max(1, int(self.max_size * self.evict_fraction))
+        max_total_size = self.max_total_size * (1 - self.evict_fraction)
+        if len(self._items) <= max_size and self.total_size <= max_total_size:
+            return
+        by_use = sorted(self._items.iteritems(), key=lambda (key, item): item[1])
+        for key, item in by_use:
+            if len(self._items) <= max_size and self.total_size <= max_total_size:
+                break
+            self._forget(key)
+            self.evictions += 1
+
+    def _forget(self, key):
+        self.total_size -= self._items.pop(key)[3]
+
+    def __delitem__(self, key):
+        self._forget(key)
+
+    def clear(self):
+        LruCache.clear(self)
+        self.total_size = 0
+
+
+class LruCacheTest(unittest.TestCase):
+    def test_lru(self):
+        cache = LruCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3 # b is the least recently used
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.get('b', 'nope'), 'nope')
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        cache['a'] = 4
+        cache['d'] = 5 # c is now the least recently used
+        self.assertEqual(sorted(cache._items.keys()), ['a', 'd'])
+        del cache['a']
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_evict_fraction(self):
+        cache = LruCache(8)
+        for i in range(8):
+            cache[i] = i
+        cache.get(0)
+        cache[8] = 8 # 1 and 2 go
+        self.assertEqual(sorted(cache._items.keys()), [0, 3, 4, 5, 6, 7, 8])
+
+    def test_evictions(self):
+        cache = LruCache(4)
+        for i in range(5):
+            cache[i] = i
+        self.assertEqual(cache.evictions, 1)
+
+
+class ExpiringLruCacheTest(unittest.TestCase):
+    def test_expiry(self):
+        cache = ExpiringLruCache(10, 100)
+        cache.set('a', 1, 1000)
+        cache.set('b', 2, 2000)
+        self.assertEqual(cache.get('a', now=999), 1)
+        self.assertEqual(cache.get('a', now=1000), None)
+        self.assertEqual(cache.get('b', now=1000), 2)
+        self.assertEqual((cache.hits, cache.misses, cache.expirations), (2, 1, 1))
+        self.assertFalse('a' in cache)
+        cache.set('b', 3, 3000)
+        self.assertEqual(cache.get('b', now=2500), 3)
+        self.assertEqual((len(cache), cache.total_size), (1, 1))
+
+    def test_total_size(self):
+        cache = ExpiringLruCache(10, 100)
+        forever = float('inf')
+        for key in 'abcd':
+            cache.set(key, key, forever, 30)
+        self.assertEqual(sorted(cache._items.keys()), ['c', 'd']) # down to 75 or under
+        cache.get('c')
+        cache.set('e', 'e', forever, 45) # d goes
+        self.assertEqual(sorted(cache._items.keys()), ['c', 'e'])
+        self.assertEqual((cache.total_size, cache.evictions), (75, 3))
+        cache.set('f', 'f', 0, 1)
+        cache.set('g', 'g', forever, 30) # f has expired, then c goes
+        self.assertEqual(sorted(cache._items.keys()), ['e', 'g'])
+        self.assertEqual((cache.expirations, cache.evictions), (1, 4))
+        del cache['g']
+        self.assertEqual(cache.total_size, 45)
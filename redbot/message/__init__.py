@@ -5,15 +5,19 @@ All checks that can be performed on a message in isolation.
 """
 
 import base64
+from collections import deque
 import hashlib
-import re
+import struct
 import time
+import unittest
 import urllib
 import urlparse
 import zlib
 
+from redbot.message.coding import decoders, DecodeError, DecodeLimitError
 from redbot.message.headers import HeaderProcessor
 from redbot.formatter import f_num
+from redbot.lru import LruCache
 from redbot.speak import Note, levels, categories
 
 from redbot.syntax import rfc3986
@@ -23,6 +27,30 @@ import thor
 ### configuration
 MAX_URI = 8000
 
+uri_memo = LruCache(1000) # {iri: (uri, whether its syntax is good)}; see HttpRequest.set_iri
+
+
+class Crc32(object):
+    """
+    A fast, non-cryptographic digest with hashlib's interface, for comparing bodies. The
+    length is part of the digest, to make collisions less likely.
+    """
+    def __init__(self):
+        self._crc = 0
+        self._len = 0
+
+    def update(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+        self._len += len(data)
+
+    def digest(self):
+        return struct.pack("!IQ", self._crc & 0xffffffff, self._len)
+
+digesters = {
+    'md5': hashlib.md5,
+    'crc32': Crc32,
+}
+
 class HttpMessage(thor.events.EventEmitter):
     """
     Base class for HTTP message state.
@@ -38,30 +66,37 @@ class HttpMessage(thor.events.EventEmitter):
         self.base_uri = ""
         self.start_time = None
         self.complete = False
+        self.truncated = False # True if we stopped reading the body before it ended
         self.complete_time = None
         self.headers = []
         self.parsed_headers = {}
         self.header_length = 0
-        self.payload = ""  # bytes, not unicode. Only used for 206 responses
+        self._payload = ""  # bytes, not unicode. Only used for 206 responses; see payload
+        self._payload_chunks = []
         self.payload_len = 0
-        self.payload_md5 = None
-        self.payload_sample = []  # [(offset, chunk)]{,4} bytes, not unicode
+        self.payload_md5 = None # set by body_done if the "md5" payload digest was wanted
+        self.payload_sample = deque()  # [(offset, chunk)] bytes, not unicode
+        self.payload_sample_size = 64 * 1024 # how many bytes of recent chunks to keep
+        self._payload_sample_len = 0
+        self.payload_prefix = bytearray() # first payload_prefix_size bytes
+        self.payload_prefix_size = 0
         self.character_encoding = None
         self.decoded_len = 0
-        self.decoded_md5 = None
-        self.decoded_sample = "" # first decoded_sample_size bytes
+        self.decoded_md5 = None # set by body_done if the "md5" decoded digest was wanted
+        self._decoded_sample = "" # first decoded_sample_size bytes; see decoded_sample
         self.decoded_sample_size = 128 * 1024
+        self._decoded_sample_chunks = []
         self._decoded_sample_seen = 0
         self.decoded_sample_complete = True
         self._decode_ok = True # turn False if we have a problem
+        self.decode_limited = False # True if decoding stopped at a decoder's limits
         self.transfer_length = 0
         self.trailers = []
         self.http_error = None  # any parse errors encountered; see httperr
-        self._md5_processor = hashlib.new('md5')
-        self._md5_post_processor = hashlib.new('md5')
-        self._gzip_processor = zlib.decompressobj(-zlib.MAX_WBITS)
-        self._in_gzip_body = False
-        self._gzip_header_buffer = ""
+        self.digests = {} # {(body, digester): digest}; set by body_done; see want_digest
+        self._payload_digesters = {} # {digester: digest object}
+        self._decoded_digesters = {}
+        self._decoders = None # [decoder] for content-codings, made when the body starts
 
     def __repr__(self):
         status = [self.__class__.__module__ + "." + self.__class__.__name__]
@@ -70,9 +105,9 @@ class HttpMessage(thor.events.EventEmitter):
     def __getstate__(self):
         state = thor.events.EventEmitter.__getstate__(self)
         for key in [
-                '_md5_processor',
-                '_md5_post_processor',
-                '_gzip_processor',
+                '_payload_digesters',
+                '_decoded_digesters',
+                '_decoders',
                 'add_note'
         ]:
             if state.has_key(key):
@@ -88,8 +123,51 @@ class HttpMessage(thor.events.EventEmitter):
         self.character_encoding = self.parsed_headers.get(
             'content-type', (None, {})
         )[1].get('charset', 'utf-8') # default isn't UTF-8, but oh well
+        if self.parsed_headers.has_key('content-md5'):
+            self.want_digest('payload', 'md5')
         self.emit("headers_available")
 
+    def _get_payload(self):
+        "The body (for 206 responses), joining the chunks seen since it was last asked for."
+        if self._payload_chunks:
+            self._payload += "".join(self._payload_chunks)
+            self._payload_chunks = []
+        return self._payload
+
+    def _set_payload(self, payload):
+        self._payload = payload
+        self._payload_chunks = []
+
+    payload = property(_get_payload, _set_payload)
+
+    def _get_decoded_sample(self):
+        "The start of the decoded body, joining the chunks seen since it was last asked for."
+        if self._decoded_sample_chunks:
+            self._decoded_sample += "".join(self._decoded_sample_chunks)
+            self._decoded_sample_chunks = []
+        return self._decoded_sample
+
+    def _set_decoded_sample(self, sample):
+        self._decoded_sample = sample
+        self._decoded_sample_chunks = []
+
+    decoded_sample = property(_get_decoded_sample, _set_decoded_sample)
+
+    def want_digest(self, body, digester='md5'):
+        """
+        Ask for a digest of the payload (body "payload") or of the decoded body ("decoded"),
+        using one of digesters; body_done puts it in digests. Digests are only computed
+        when they're wanted, so this needs to be called before the body starts.
+        """
+        if body == 'payload':
+            processors = self._payload_digesters
+        elif body == 'decoded':
+            processors = self._decoded_digesters
+        else:
+            raise ValueError, body
+        if not processors.has_key(digester):
+            processors[digester] = digesters[digester]()
+
     def feed_body(self, chunk):
         """
         Feed a chunk of the body in.
@@ -98,24 +176,30 @@ class HttpMessage(thor.events.EventEmitter):
         run over the chunk.
 
         decoded_sample is also populated.
+
+        Chunks are only kept in lists (and joined when payload or decoded_sample is asked
+        for), so the cost of each chunk doesn't depend upon how much of the body has already
+        been seen. What's been read is available even if body_done is never called.
         """
-        self.payload_sample.append((self.payload_len, chunk))
-        if len(self.payload_sample) > 4: # TODO: bytes, not chunks
-            self.payload_sample.pop(0)
-        self._md5_processor.update(chunk)
+        self._sample_payload(chunk)
+        if len(self.payload_prefix) < self.payload_prefix_size:
+            self.payload_prefix.extend(
+                chunk[:self.payload_prefix_size - len(self.payload_prefix)])
+        for processor in self._payload_digesters.itervalues():
+            processor.update(chunk)
         self.payload_len += len(chunk)
         if (not self.is_request) and self.status_code == "206":
             # only store 206; don't try to understand it
-            self.payload += chunk
+            self._payload_chunks.append(chunk)
         else:
             decoded_chunk = self._process_content_codings(chunk)
             if self._decode_ok:
-                if self._decoded_sample_seen + len(decoded_chunk) < self.decoded_sample_size:
-                    self.decoded_sample += decoded_chunk
+                room = self.decoded_sample_size - self._decoded_sample_seen
+                if len(decoded_chunk) < room:
+                    self._decoded_sample_chunks.append(decoded_chunk)
                     self._decoded_sample_seen += len(decoded_chunk)
-                elif self._decoded_sample_seen < self.decoded_sample_size:
-                    max_chunk = self.decoded_sample_size - self._decoded_sample_seen
-                    self.decoded_sample += decoded_chunk[:max_chunk]
+                elif room > 0:
+                    self._decoded_sample_chunks.append(decoded_chunk[:room])
                     self._decoded_sample_seen += len(decoded_chunk)
                     self.decoded_sample_complete = False
                 else:
@@ -124,19 +208,39 @@ class HttpMessage(thor.events.EventEmitter):
             else:
                 self.decoded_sample_complete = False
 
+    def _sample_payload(self, chunk):
+        """
+        Add a chunk to payload_sample, dropping the oldest ones so that no more than
+        payload_sample_size bytes (but always the last chunk seen) are kept.
+        """
+        offset = self.payload_len
+        if len(chunk) > self.payload_sample_size:
+            offset += len(chunk) - self.payload_sample_size
+            chunk = chunk[-self.payload_sample_size:]
+        self.payload_sample.append((offset, chunk))
+        self._payload_sample_len += len(chunk)
+        while self._payload_sample_len > self.payload_sample_size:
+            self._payload_sample_len -= len(self.payload_sample.popleft()[1])
+
     def body_done(self, complete, trailers=None):
         """
         Signal that the body is done. Complete should be True if we
         know it's complete.
+
+        If the message is truncated, checks that need the whole body are skipped.
         """
         # TODO: check trailers
         self.complete = complete
         self.trailers = trailers or []
-        self.payload_md5 = self._md5_processor.digest()
-        self.decoded_md5 = self._md5_post_processor.digest()
-
-        if self.is_request or \
-          (not self.is_head_response and self.status_code not in ['304']):
+        for body, processors in [('payload', self._payload_digesters),
+                                 ('decoded', self._decoded_digesters)]:
+            for digester, processor in processors.items():
+                self.digests[(body, digester)] = processor.digest()
+        self.payload_md5 = self.digests.get(('payload', 'md5'), None)
+        self.decoded_md5 = self.digests.get(('decoded', 'md5'), None)
+
+        if not self.truncated and (self.is_request or \
+          (not self.is_head_response and self.status_code not in ['304'])):
             # check payload basics
             if self.parsed_headers.has_key('content-length'):
                 if self.payload_len == self.parsed_headers['content-length']:
@@ -156,96 +260,34 @@ class HttpMessage(thor.events.EventEmitter):
 
     def _process_content_codings(self, chunk):
         """
-        Decode a chunk according to the message's content-encoding header.
-
-        Currently supports gzip.
+        Decode a chunk according to the message's content-encoding header, using the
+        decoders in redbot.message.coding.
         """
-        content_codings = self.parsed_headers.get('content-encoding', [])
-        content_codings.reverse()
-        for coding in content_codings:
-            # TODO: deflate support
-            if coding in ['gzip', 'x-gzip'] and self._decode_ok:
-                if not self._in_gzip_body:
-                    self._gzip_header_buffer += chunk
-                    try:
-                        chunk = self._read_gzip_header(self._gzip_header_buffer)
-                        self._in_gzip_body = True
-                    except IndexError:
-                        return '' # not a full header yet
-                    except IOError, gzip_error:
-                        self.add_note('header-content-encoding',
-                                      BAD_GZIP,
-                                      gzip_error=str(gzip_error))
-                        self._decode_ok = False
-                        return
-                try:
-                    chunk = self._gzip_processor.decompress(chunk)
-                except zlib.error, zlib_error:
-                    self.add_note(
-                        'header-content-encoding',
-                        BAD_ZLIB,
-                        zlib_error=str(zlib_error),
-                        ok_zlib_len=f_num(self.payload_sample[-1][0]),
-                        chunk_sample=chunk[:20].encode('string_escape')
-                    )
+        if not self._decode_ok:
+            return
+        if self._decoders is None:
+            self._decoders = []
+            # decode in the opposite order to that they were applied in.
+            for coding in reversed(self.parsed_headers.get('content-encoding', [])):
+                if not decoders.has_key(coding):
+                    # we can't handle other codecs, so punt on body processing.
                     self._decode_ok = False
                     return
-            else:
-                # we can't handle other codecs, so punt on body processing.
+                self._decoders.append(decoders[coding]())
+        for decoder in self._decoders:
+            try:
+                chunk = decoder.decode(chunk)
+            except DecodeError, why:
+                if isinstance(why, DecodeLimitError):
+                    self.decode_limited = True
+                self.add_note('header-content-encoding', why.note, **why.kw)
                 self._decode_ok = False
                 return
-        self._md5_post_processor.update(chunk)
+        for processor in self._decoded_digesters.itervalues():
+            processor.update(chunk)
         self.decoded_len += len(chunk)
         return chunk
 
-    @staticmethod
-    def _read_gzip_header(content):
-        """
-        Parse a string for a GZIP header; if present, return remainder of
-        gzipped content.
-        """
-        # adapted from gzip.py
-        gz_flags = {
-            'FTEXT': 1,
-            'FHCRC': 2,
-            'FEXTRA': 4,
-            'FNAME': 8,
-            'FCOMMENT': 16
-        }
-        if len(content) < 10:
-            raise IndexError, "Header not complete yet"
-        magic = content[:2]
-        if magic != '\037\213':
-            raise IOError, \
-                u'Not a gzip header (magic is hex %s, should be 1f8b)' % \
-                magic.encode('hex-codec')
-        method = ord(content[2:3])
-        if method != 8:
-            raise IOError, 'Unknown compression method'
-        flag = ord(content[3:4])
-        content_l = list(content[10:])
-        if flag & gz_flags['FEXTRA']:
-            # Read & discard the extra field, if present
-            xlen = ord(content_l.pop(0))
-            xlen = xlen + 256*ord(content_l.pop(0))
-            content_l = content_l[xlen:]
-        if flag & gz_flags['FNAME']:
-            # Read and discard a null-terminated string
-            # containing the filename
-            while True:
-                st1 = content_l.pop(0)
-                if not content_l or st1 == '\000':
-                    break
-        if flag & gz_flags['FCOMMENT']:
-            # Read and discard a null-terminated string containing a comment
-            while True:
-                st2 = content_l.pop(0)
-                if not content_l or st2 == '\000':
-                    break
-        if flag & gz_flags['FHCRC']:
-            content_l = content_l[2:]   # Read & discard the 16-bit header CRC
-        return "".join(content_l)
-
 
 class HttpRequest(HttpMessage):
     """
@@ -260,13 +302,21 @@ class HttpRequest(HttpMessage):
     def set_iri(self, iri):
         """
         Given an IRI or URI, convert to a URI and make sure it's sensible.
+
+        The results for recently seen IRIs are kept in uri_memo; ones that can't be
+        converted aren't, since they're rare.
         """
-        try:
-            self.uri = self.iri_to_uri(iri)
-        except (ValueError, UnicodeError), why:
-            self.http_error = thor.http.error.UrlError(why[0])
-            return
-        if not re.match(r"^\s*%s\s*$" % rfc3986.URI, self.uri, re.VERBOSE):
+        result = uri_memo.get(iri)
+        if result is None:
+            try:
+                uri = self.iri_to_uri(iri)
+            except (ValueError, UnicodeError), why:
+                self.http_error = thor.http.error.UrlError(why[0])
+                return
+            result = (uri, rfc3986.is_uri(uri))
+            uri_memo[iri] = result
+        self.uri, syntax_ok = result
+        if not syntax_ok:
             self.add_note('uri', URI_BAD_SYNTAX)
         if '#' in self.uri:
             # chop off the fragment
@@ -302,6 +352,7 @@ class HttpResponse(HttpMessage):
         self.is_head_response = False
         self.status_code = None
         self.status_phrase = ""
+        self.conn_reused = None # whether the connection had been used before
         self.freshness_lifetime = None
         self.age = None
         self.store_shared = None
@@ -327,6 +378,119 @@ class DummyMsg(HttpResponse):
 
 
 
+class FeedBodyTest(unittest.TestCase):
+    def feed(self, status_code, chunks):
+        msg = DummyMsg()
+        msg.status_code = status_code
+        msg.decoded_sample_size = 10
+        msg.payload_sample_size = 8
+        for chunk in chunks:
+            msg.feed_body(chunk)
+        msg.body_done(True)
+        return msg
+
+    def test_samples(self):
+        msg = self.feed("200", ["abc", "defg", "hij", "klmnopqrstu"])
+        self.assertEqual(msg.decoded_sample, "abcdefghij")
+        self.assertFalse(msg.decoded_sample_complete)
+        self.assertEqual(list(msg.payload_sample), [(13, "nopqrstu")])
+        self.assertEqual(msg.payload, "")
+
+    def test_payload_sample(self):
+        msg = self.feed("200", ["abc", "defg", "hi"])
+        self.assertEqual(list(msg.payload_sample), [(3, "defg"), (7, "hi")])
+        self.assertEqual(msg.decoded_sample, "abcdefghi")
+        self.assertTrue(msg.decoded_sample_complete)
+
+    def test_stacked_codings(self):
+        body = "hello, world. " * 100
+        deflate = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS)
+        encoded = deflate.compress(body) + deflate.flush()
+        gzip = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        encoded = gzip.compress(encoded) + gzip.flush()
+        msg = DummyMsg()
+        msg.status_code = "200"
+        msg.parsed_headers['content-encoding'] = ['deflate', 'gzip']
+        for i in range(0, len(encoded), 5):
+            msg.feed_body(encoded[i:i + 5])
+        msg.body_done(True)
+        self.assertEqual(msg.decoded_sample, body)
+        self.assertEqual(msg.parsed_headers['content-encoding'], ['deflate', 'gzip'])
+
+    def test_unknown_coding(self):
+        msg = DummyMsg()
+        msg.status_code = "200"
+        msg.parsed_headers['content-encoding'] = ['foo']
+        msg.feed_body("abc")
+        self.assertFalse(msg._decode_ok)
+        self.assertEqual(msg._decoders, [])
+
+    def test_digests(self):
+        msg = self.feed("200", ["abc", "defg"])
+        self.assertEqual(msg.digests, {})
+        self.assertEqual(msg.payload_md5, None)
+        msg = DummyMsg()
+        msg.status_code = "200"
+        msg.want_digest('payload', 'md5')
+        msg.want_digest('payload', 'crc32')
+        msg.want_digest('decoded', 'crc32')
+        for chunk in ["abc", "defg"]:
+            msg.feed_body(chunk)
+        msg.body_done(True)
+        self.assertEqual(msg.payload_md5, hashlib.md5("abcdefg").digest())
+        self.assertEqual(msg.digests[('payload', 'crc32')], msg.digests[('decoded', 'crc32')])
+        self.assertNotEqual(msg.digests[('payload', 'crc32')], Crc32().digest())
+
+    def test_decode_limit(self):
+        gzip = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        encoded = gzip.compress("\000" * 4 * 1024 * 1024) + gzip.flush()
+        msg = DummyMsg()
+        msg.status_code = "200"
+        msg.parsed_headers['content-encoding'] = ['gzip']
+        for i in range(0, len(encoded), 1024):
+            msg.feed_body(encoded[i:i + 1024])
+        msg.body_done(True)
+        self.assertTrue(msg.decode_limited)
+        self.assertTrue('DECODE_LIMIT' in msg.note_classes)
+        self.assertTrue(msg.decoded_len < 4 * 1024 * 1024)
+
+    def test_unfinished(self):
+        msg = DummyMsg()
+        msg.status_code = "206"
+        msg.feed_body("abc")
+        self.assertEqual(msg.payload, "abc")
+        msg.feed_body("def")
+        self.assertEqual(msg.payload, "abcdef")
+        msg.status_code = "200"
+        msg.feed_body("ghi")
+        self.assertEqual(msg.decoded_sample, "ghi")
+        self.assertFalse(msg.complete)
+
+    def test_206(self):
+        msg = self.feed("206", ["abc", "defg"])
+        self.assertEqual(msg.payload, "abcdefg")
+        self.assertEqual(msg.decoded_sample, "")
+
+
+class SetIriTest(unittest.TestCase):
+    def set_iri(self, iri):
+        notes = []
+        req = HttpRequest(lambda subject, note, **kw: notes.append(note.__name__))
+        req.set_iri(iri)
+        return req.uri, notes
+
+    def test_set_iri(self):
+        iri = u"http://\u00e9.example.com/a?b#c"
+        for i in range(2):
+            self.assertEqual(self.set_iri(iri), ("http://xn--9ca.example.com/a?b", []))
+        self.assertEqual(uri_memo.get(iri)[0], "http://xn--9ca.example.com/a?b#c")
+        self.assertEqual(self.set_iri(u"http://example.com:8o/"),
+                         ("http://example.com:8o/", ['URI_BAD_SYNTAX']))
+        req = HttpRequest(None)
+        req.set_iri(u"http://%s.example.com/" % ("a" * 70))
+        self.assertTrue(req.http_error)
+
+
 class URI_TOO_LONG(Note):
     category = categories.GENERAL
     level = levels.WARN
@@ -380,24 +544,3 @@ class CMD5_INCORRECT(Note):
 `Content-MD5` is a hash of the body, and can be used to ensure integrity of the response. RED has
 checked its value and found it to be incorrect; i.e., the given `Content-MD5` does not match what
 RED thinks it should be (%(calc_md5)s)."""
-
-class BAD_GZIP(Note):
-    category = categories.CONNEG
-    level = levels.BAD
-    summary = u"%(response)s was compressed using GZip, but the header wasn't \
-valid."
-    text = u"""\
-GZip-compressed responses have a header that contains metadata. %(response)s's header wasn't valid;
-the error encountered was "`%(gzip_error)s`"."""
-
-class BAD_ZLIB(Note):
-    category = categories.CONNEG
-    level = levels.BAD
-    summary = u"%(response)s was compressed using GZip, but the data was corrupt."
-    text = u"""\
-GZip-compressed responses use zlib compression to reduce the number of bytes transferred on the
-wire. However, this response could not be decompressed; the error encountered was
-"`%(zlib_error)s`".
-
-%(ok_zlib_len)s bytes were decompressed successfully before this; the erroneous chunk starts with
-"`%(chunk_sample)s`"."""
\ No newline at end of file
@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+
+"""
+Streaming decoders for content-codings.
+
+decoders maps each content-coding name to a decoder class. A message creates a decoder for
+each coding it uses when its body starts; decode() is called with each chunk of the encoded
+body in turn, and returns what it decodes to (possibly nothing, yet). Problems raise
+DecodeError.
+
+Decoders stop (raising DecodeLimitError) rather than produce more than max_decoded bytes, or more
+than max_ratio times the number of encoded bytes they've been given (once they've produced
+ratio_floor bytes), to guard against decompression bombs.
+
+To support another coding, add its decoder class to decoders.
+"""
+
+import unittest
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from redbot.formatter import f_num
+from redbot.speak import Note, categories, levels
+
+
+class DecodeError(Exception):
+    "A problem decoding; note is the Note class to set, with kw as its variables."
+    def __init__(self, note, **kw):
+        Exception.__init__(self, note.__name__)
+        self.note = note
+        self.kw = kw
+
+
+class DecodeLimitError(DecodeError):
+    "Decoding stopped because it would have produced too much."
+    pass
+
+
+class Decoder(object):
+    "Limit accounting shared by decoders; each provides decode(chunk)."
+    coding = None
+    max_decoded = 64 * 1024 * 1024 # bytes
+    max_ratio = 250 # decoded bytes per encoded byte
+    ratio_floor = 1024 * 1024 # bytes decoded before max_ratio applies
+
+    def __init__(self):
+        self.consumed = 0 # how many encoded bytes have been decoded
+        self.decoded = 0 # how many bytes they decoded to
+
+    def _room(self, chunk_len):
+        "How many more bytes we're willing to produce, once chunk_len more bytes are consumed."
+        room = max(self.ratio_floor, self.max_ratio * (self.consumed + chunk_len))
+        return min(room, self.max_decoded) - self.decoded
+
+    def _limit(self):
+        "Raise DecodeLimitError about the limit that's been reached."
+        if self.decoded >= self.max_decoded:
+            limit = u"more than %s bytes" % f_num(self.max_decoded)
+        else:
+            limit = u"more than %s times the size of the encoded data" % f_num(self.max_ratio)
+        raise DecodeLimitError(DECODE_LIMIT, coding=self.coding, limit=limit,
+                               decoded_len=f_num(self.decoded))
+
+
+class ZlibDecoder(Decoder):
+    "Base class for codings that use zlib."
+
+    def __init__(self):
+        Decoder.__init__(self)
+        self._zlib = None
+
+    def _inflate(self, chunk):
+        "Decompress a chunk with _zlib, producing no more than we have room for."
+        room = self._room(len(chunk))
+        if room <= 0:
+            if chunk:
+                self._limit()
+            return ''
+        try:
+            decoded = self._zlib.decompress(chunk, room)
+        except zlib.error, zlib_error:
+            raise DecodeError(BAD_ZLIB,
+                              coding=self.coding,
+                              zlib_error=str(zlib_error),
+                              ok_zlib_len=f_num(self.consumed),
+                              chunk_sample=chunk[:20].encode('string_escape'))
+        self.consumed += len(chunk) - len(self._zlib.unconsumed_tail)
+        self.decoded += len(decoded)
+        if self._zlib.unconsumed_tail: # there's more, but no room for it.
+            self._limit()
+        return decoded
+
+
+class GzipDecoder(ZlibDecoder):
+    "Decode gzip (see RFC1952)."
+    coding = 'gzip'
+
+    def __init__(self):
+        ZlibDecoder.__init__(self)
+        self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._header = GzipHeaderReader()
+
+    def decode(self, chunk):
+        if not self._header.done:
+            try:
+                chunk = self._header.feed(chunk)
+            except IOError, gzip_error:
+                raise DecodeError(BAD_GZIP, gzip_error=str(gzip_error))
+            if chunk is None:
+                return '' # not a full header yet
+        return self._inflate(chunk)
+
+
+class DeflateDecoder(ZlibDecoder):
+    """
+    Decode deflate. It's supposed to be zlib-wrapped (see RFC1950), but some servers send raw
+    deflate (see RFC1951) instead; which it is is decided from the first two bytes.
+    """
+    coding = 'deflate'
+
+    def __init__(self):
+        ZlibDecoder.__init__(self)
+        self._start = "" # the first byte, if it came on its own
+        self.wrapped = None
+
+    def decode(self, chunk):
+        if self._zlib is None:
+            if self._start:
+                chunk = self._start + str(chunk)
+            if len(chunk) < 2:
+                self._start = str(chunk)
+                return ''
+            self._start = ""
+            cmf, flg = ord(chunk[0]), ord(chunk[1])
+            self.wrapped = cmf & 0x0f == 8 and (cmf * 256 + flg) % 31 == 0
+            self._zlib = zlib.decompressobj(self.wrapped and zlib.MAX_WBITS or -zlib.MAX_WBITS)
+        return self._inflate(chunk)
+
+
+class BrotliDecoder(Decoder):
+    """
+    Decode brotli (see RFC7932), if a brotli module that can bound its output (1.2.0 or
+    later) is available.
+    """
+    coding = 'br'
+
+    def __init__(self):
+        Decoder.__init__(self)
+        self._brotli = brotli.Decompressor()
+
+    def decode(self, chunk):
+        room = self._room(len(chunk))
+        if room <= 0:
+            if chunk:
+                self._limit()
+            return ''
+        try:
+            decoded = self._brotli.process(str(chunk), output_buffer_limit=room)
+            more = not self._brotli.can_accept_more_data()
+        except brotli.error, brotli_error:
+            raise DecodeError(BAD_BROTLI, brotli_error=str(brotli_error))
+        if len(decoded) > room: # the limit is rounded up to the decompressor's buffer size
+            decoded, more = decoded[:room], True
+        self.consumed += len(chunk)
+        self.decoded += len(decoded)
+        if more: # there's more, but no room for it.
+            self._limit()
+        return decoded
+
+
+decoders = {
+    'gzip': GzipDecoder,
+    'x-gzip': GzipDecoder,
+    'deflate': DeflateDecoder,
+}
+if brotli and hasattr(brotli.Decompressor, 'can_accept_more_data'):
+    decoders['br'] = BrotliDecoder
+
+
+class GzipHeaderReader(object):
+    """
+    Read a gzip header (see RFC1952) incrementally, from chunks of any size.
+
+    feed() each chunk in turn; it returns None until the header is complete, and then what
+    follows the header in that chunk (without copying it). Problems with the header raise
+    IOError.
+    """
+    FHCRC = 2
+    FEXTRA = 4
+    FNAME = 8
+    FCOMMENT = 16
+
+    def __init__(self):
+        self.done = False
+        self._steps = [self._fixed] # what's left to read, in order
+        self._field = "" # the fixed-size field being read, so far
+        self._skip = 0 # how much of the extra field is left
+
+    def feed(self, chunk):
+        "Feed a chunk in; return the rest of it if the header is complete, else None."
+        if self.done:
+            return chunk
+        offset = 0
+        while self._steps:
+            offset = self._steps[0](chunk, offset)
+            if offset is None:
+                return None # need more.
+            self._steps.pop(0)
+        self.done = True
+        if offset:
+            return buffer(chunk, offset)
+        return chunk
+
+    # Each step reads from chunk at offset, returning the offset after it if it's done, or
+    # None if it consumed the rest of the chunk without finishing.
+
+    def _read_field(self, chunk, offset, size):
+        """
+        Accumulate a fixed-size field in _field; return the offset after it if it's complete,
+        else None.
+        """
+        take = size - len(self._field)
+        self._field += chunk[offset:offset + take]
+        if len(self._field) < size:
+            return None
+        return offset + take
+
+    def _fixed(self, chunk, offset):
+        "The ten-byte fixed header."
+        offset = self._read_field(chunk, offset, 10)
+        if offset is None:
+            return None
+        field, self._field = self._field, ""
+        magic = field[:2]
+        if magic != '\037\213':
+            raise IOError, \
+                u'Not a gzip header (magic is hex %s, should be 1f8b)' % \
+                magic.encode('hex-codec')
+        if ord(field[2]) != 8:
+            raise IOError, 'Unknown compression method'
+        flag = ord(field[3])
+        if flag & self.FEXTRA:
+            self._steps += [self._extra_len, self._extra]
+        if flag & self.FNAME:
+            self._steps.append(self._terminated)
+        if flag & self.FCOMMENT:
+            self._steps.append(self._terminated)
+        if flag & self.FHCRC:
+            self._steps.append(self._hcrc)
+        return offset
+
+    def _extra_len(self, chunk, offset):
+        "The length of the extra field."
+        offset = self._read_field(chunk, offset, 2)
+        if offset is None:
+            return None
+        field, self._field = self._field, ""
+        self._skip = ord(field[0]) + 256 * ord(field[1])
+        return offset
+
+    def _extra(self, chunk, offset):
+        "Skip the extra field."
+        take = min(self._skip, len(chunk) - offset)
+        self._skip -= take
+        if self._skip:
+            return None
+        return offset + take
+
+    def _terminated(self, chunk, offset):
+        "Skip a zero-terminated string (the file name or comment)."
+        end = chunk.find('\000', offset)
+        if end == -1:
+            return None
+        return end + 1
+
+    def _hcrc(self, chunk, offset):
+        "Skip the header CRC."
+        offset = self._read_field(chunk, offset, 2)
+        if offset is not None:
+            self._field = ""
+        return offset
+
+
+class BAD_GZIP(Note):
+    category = categories.CONNEG
+    level = levels.BAD
+    summary = u"%(response)s was compressed using GZip, but the header wasn't \
+valid."
+    text = u"""\
+GZip-compressed responses have a header that contains metadata. %(response)s's header wasn't valid;
+the error encountered was "`%(gzip_error)s`"."""
+
+class BAD_ZLIB(Note):
+    category = categories.CONNEG
+    level = levels.BAD
+    summary = u"%(response)s was compressed using %(coding)s, but the data was corrupt."
+    text = u"""\
+Responses compressed with `%(coding)s` use zlib compression to reduce the number of bytes
+transferred on the wire. However, this response could not be decompressed; the error encountered
+was "`%(zlib_error)s`".
+
+%(ok_zlib_len)s bytes were decompressed successfully before this; the erroneous chunk starts with
+"`%(chunk_sample)s`"."""
+
+class DECODE_LIMIT(Note):
+    category = categories.CONNEG
+    level = levels.WARN
+    summary = u"RED stopped decoding %(response)s's body after %(decoded_len)s bytes."
+    text = u"""\
+%(response)s's body is encoded with `%(coding)s`. Decoded, it's %(limit)s, which is more than
+RED is willing to handle (very large expansions are a sign of a "decompression bomb"), so RED
+stopped decoding it.
+
+Other checks continue, but those that use the decoded body (such as link parsing and the body
+sample) only cover what was decoded."""
+
+class BAD_BROTLI(Note):
+    category = categories.CONNEG
+    level = levels.BAD
+    summary = u"%(response)s was compressed using brotli, but the data was corrupt."
+    text = u"""\
+%(response)s could not be decompressed; the error encountered was "`%(brotli_error)s`"."""
+
+
+class GzipHeaderReaderTest(unittest.TestCase):
+    header = "\037\213\010" + chr(2 | 4 | 8 | 16) + "\000" * 6 + \
+      "\003\000xyz" + "name\000" + "comment\000" + "cc"
+
+    def read(self, chunks):
+        reader = GzipHeaderReader()
+        rest = [reader.feed(chunk) for chunk in chunks]
+        self.assertTrue(reader.done)
+        return "".join([str(r) for r in rest if r is not None])
+
+    def test_split(self):
+        stream = self.header + "body"
+        for i in range(len(stream)):
+            self.assertEqual(self.read([stream[:i], stream[i:]]), "body")
+        self.assertEqual(self.read(list(stream)), "body")
+
+    def test_incomplete(self):
+        reader = GzipHeaderReader()
+        self.assertEqual(reader.feed(self.header[:-1]), None)
+        self.assertFalse(reader.done)
+
+    def test_bad(self):
+        self.assertRaises(IOError, GzipHeaderReader().feed, "\037\214" + self.header[2:])
+        self.assertRaises(IOError, GzipHeaderReader().feed, "\037\213\007" + self.header[3:])
+
+
+class DecoderTest(unittest.TestCase):
+    body = "hello, world. " * 100
+
+    def decode(self, decoder, encoded, size):
+        return "".join([decoder.decode(encoded[i:i + size])
+                        for i in range(0, len(encoded), size)])
+
+    def test_deflate(self):
+        for wbits in [zlib.MAX_WBITS, -zlib.MAX_WBITS]:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, wbits)
+            encoded = compressor.compress(self.body) + compressor.flush()
+            for size in [1, 7, len(encoded)]:
+                decoder = DeflateDecoder()
+                self.assertEqual(self.decode(decoder, encoded, size), self.body)
+                self.assertEqual(decoder.wrapped, wbits > 0)
+
+    def test_limits(self):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS)
+        encoded = compressor.compress("\000" * 1024 * 1024) + compressor.flush()
+        for attr, value, limit in [('max_decoded', 10000, u"more than 10000 bytes"),
+                                   ('max_ratio', 10, u"more than 10 times the size of the encoded data")]:
+            decoder = DeflateDecoder()
+            decoder.ratio_floor = 1000
+            setattr(decoder, attr, value)
+            try:
+                self.decode(decoder, encoded, 100)
+            except DecodeLimitError, why:
+                self.assertEqual(why.note, DECODE_LIMIT)
+                self.assertEqual(why.kw['limit'], limit)
+                self.assertTrue(decoder.decoded <= max(value, 1000))
+            else:
+                self.fail("no DecodeLimitError")
+        decoder = DeflateDecoder()
+        self.assertEqual(self.decode(decoder, encoded, 100), "\000" * 1024 * 1024)
+
+    def test_bad_zlib(self):
+        decoder = DeflateDecoder()
+        try:
+            decoder.decode("\x78\x9c" + "garbage")
+        except DecodeError, why:
+            self.assertEqual(why.note, BAD_ZLIB)
+            self.assertEqual(why.kw['coding'], 'deflate')
+        else:
+            self.fail("no DecodeError")
+
+
+@unittest.skipIf('br' not in decoders, "brotli 1.2.0 or later isn't available")
+class BrotliDecoderTest(unittest.TestCase):
+    body = "hello, world. " * 100
+
+    def decode(self, decoder, encoded, size):
+        return "".join([decoder.decode(encoded[i:i + size])
+                        for i in range(0, len(encoded), size)])
+
+    def test_decode(self):
+        encoded = brotli.compress(self.body)
+        for size in [1, 7, len(encoded)]:
+            self.assertEqual(self.decode(BrotliDecoder(), encoded, size), self.body)
+
+    def test_limits(self):
+        encoded = brotli.compress("\000" * 16 * 1024 * 1024)
+        for attr, value, limit in [('max_decoded', 5000, u"more than 5000 bytes"),
+                                   ('max_ratio', 10, u"more than 10 times the size of the encoded data")]:
+            decoder = BrotliDecoder()
+            decoder.ratio_floor = 1000
+            setattr(decoder, attr, value)
+            try:
+                decoder.decode(encoded) # one small chunk that decodes to a lot
+            except DecodeLimitError, why:
+                self.assertEqual(why.note, DECODE_LIMIT)
+                self.assertEqual(why.kw['limit'], limit)
+                self.assertTrue(decoder.decoded <= max(value, 1000))
+            else:
+                self.fail("no DecodeLimitError")
+
+    def test_bad_brotli(self):
+        try:
+            BrotliDecoder().decode("garbage" * 10)
+        except DecodeError, why:
+            self.assertEqual(why.note, BAD_BROTLI)
+        else:
+            self.fail("no DecodeError")
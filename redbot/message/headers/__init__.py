@@ -8,14 +8,18 @@ process_headers() will process a list of (key, val) tuples.
 
 from copy import copy
 from functools import partial
+import os
+import pkgutil
 import re
 import sys
 import unittest
 
-from redbot.syntax import rfc7230, rfc7231
+from redbot.lru import LruCache
+from redbot.syntax import rfc7230, rfc7231, LazyRegex
 from redbot.formatter import f_num
 
-from ._utils import RE_FLAGS, parse_date, unquote_string, split_string, parse_params
+from ._utils import RE_FLAGS, parse_date, unquote_string, split_string, split_list, \
+  parse_params
 from ._notes import *
 
 # base URLs for references
@@ -28,6 +32,11 @@ rfc6266 = u"http://tools.ietf.org/html/rfc6266.html#section-4"
 MAX_HDR_SIZE = 4 * 1024
 MAX_TTL_HDR = 8 * 1000
 
+FIELD_NAME_RE = LazyRegex(r"^%s$" % rfc7230.token, RE_FLAGS)
+syntax_registry = {} # {HttpHeader subclass: compiled syntax for one value, or None}
+# {(HttpHeader subclass, field value, is_request): ([parsed value], [(note, kw)])}
+parse_cache = LruCache(5000)
+
 
 class HttpHeader(object):
     """A HTTP Header handler."""
@@ -41,6 +50,7 @@ class HttpHeader(object):
     valid_in_requests = None
     valid_in_responses = None
     no_coverage = False  # turns off coverage checks for syntax and tests.
+    cacheable = True # parse() only depends upon the field value; see handle_input.
 
     def __init__(self, wire_name, message):
         self.wire_name = wire_name.strip()
@@ -63,23 +73,60 @@ class HttpHeader(object):
         """
         pass
 
+    @classmethod
+    def syntax_re(cls):
+        """
+        Return the compiled regex that each of the header's values has to match, or None if
+        it doesn't have a syntax. It's compiled when first asked for, and kept in
+        syntax_registry.
+        """
+        try:
+            return syntax_registry[cls]
+        except KeyError:
+            if cls.syntax:
+                element_syntax = isinstance(cls.syntax, rfc7230.list_rule) \
+                  and cls.syntax.element or cls.syntax
+                syntax = re.compile(r"^\s*(?:%s)\s*$" % element_syntax, RE_FLAGS)
+            else:
+                syntax = None
+            syntax_registry[cls] = syntax
+            return syntax
+
     def handle_input(self, field_value, add_note):
         """
         Basic input processing on a new field value.
+
+        If the header is cacheable, the parsed values and the notes made for a field value
+        are kept in parse_cache, and replayed when the same value is seen again (in the same
+        kind of message). Parsed values are shared, so they mustn't be modified.
         """
+        if not self.cacheable:
+            return self._handle_input(field_value, add_note)
+        key = (self.__class__, field_value, self.message.is_request)
+        result = parse_cache.get(key)
+        if result is None:
+            notes = []
+            value_count = len(self.value)
+            self._handle_input(field_value, lambda note, **kw: notes.append((note, kw)))
+            result = (self.value[value_count:], notes)
+            parse_cache[key] = result
+        else:
+            self.value.extend(result[0])
+        for note, kw in result[1]:
+            add_note(note, **kw)
 
+    def _handle_input(self, field_value, add_note):
+        "Split, check and parse a new field value."
         # split before processing if a list header
         if self.list_header:
             values = self.split_list_header(field_value)
         else:
             values = [field_value]
+        syntax = self.syntax_re()
         for value in values:
           # check field value syntax
-            if self.syntax:
-                element_syntax = isinstance(self.syntax, rfc7230.list_rule) \
-                  and self.syntax.element or self.syntax
-                if not re.match(r"^\s*(?:%s)\s*$" % element_syntax, value, RE_FLAGS):
-                    add_note(BAD_SYNTAX, ref_uri=self.reference)
+            if syntax and not syntax.match(value):
+                add_note(BAD_SYNTAX, ref_uri=self.reference)
             try:
                 parsed_value = self.parse(value.strip(), add_note)
             except ValueError:
@@ -89,12 +136,7 @@ class HttpHeader(object):
     @staticmethod
     def split_list_header(field_value):
         "Split a header field value on commas. needs to conform to the #rule."
-        return [f.strip() for f in
-                re.findall(r'((?:[^",]|%s)+)(?=%s|\s*$)' % (
-                    rfc7230.quoted_string,
-                    r"(?:\s*(?:,\s*)+)"
-                ), field_value, RE_FLAGS)
-                if f] or []
+        return split_list(field_value)
 
     def finish(self, message, add_note):
         """
@@ -102,7 +144,7 @@ class HttpHeader(object):
         """
 
         # check field name syntax
-        if not re.match("^%s$" % rfc7230.token, self.wire_name, RE_FLAGS):
+        if not FIELD_NAME_RE.match(self.wire_name):
             add_note(FIELD_NAME_BAD_SYNTAX)
         if self.deprecated:
             deprecation_ref = getattr(self, 'deprecation_ref', self.reference)
@@ -130,6 +172,7 @@ class DummyHttpHeader(HttpHeader):
     list_header = True
     valid_in_requests = True
     valid_in_responses = True
+    cacheable = False # unknown headers' values are often unique, and cheap to handle.
 
     def parse(self, field_value, add_note):
         return field_value
@@ -141,6 +184,10 @@ class DummyHttpHeader(HttpHeader):
 class HeaderProcessor(object):
     """
     Parses and runs checks on a set of headers.
+
+    Header handlers are found using a table of the header modules in this package (plus
+    header_aliases), built the first time it's needed. Handler classes are cached as they're
+    found, as are the names that don't have one.
     """
     # map of header name aliases, lowercase-normalised
     header_aliases = {
@@ -154,6 +201,8 @@ class HeaderProcessor(object):
         'x_cnection': 'connectiox',
         '_onnection': 'connectiox',
     }
+    _header_modules = None # {name token: module name}; see header_modules()
+    _header_classes = {}   # {name token: handler class, or None}; only names with a module
 
     def __init__(self, message):
         self.message = message
@@ -239,13 +288,19 @@ class HeaderProcessor(object):
 
         If default is true, return a dummy if one isn't found; otherwise, None.
         """
-
         name_token = HeaderProcessor.name_token(header_name)
-        hdr_module = HeaderProcessor.find_header_module(name_token)
-        if hdr_module and hasattr(hdr_module, name_token):
-            return getattr(hdr_module, name_token)
-        if default:
+        try:
+            handler = HeaderProcessor._header_classes[name_token]
+        except KeyError:
+            handler = None
+            hdr_module = HeaderProcessor.find_header_module(name_token)
+            if hdr_module:
+                handler = getattr(hdr_module, hdr_module.__name__.rsplit(".", 1)[-1], None)
+                # names without a module aren't kept; servers can send any number of them.
+                HeaderProcessor._header_classes[name_token] = handler
+        if handler is None and default:
             return DummyHttpHeader
+        return handler
 
     @staticmethod
     def find_header_module(header_name):
@@ -253,17 +308,33 @@ class HeaderProcessor(object):
         Return a module for the given field name, or None if it can't be found.
         """
         name_token = HeaderProcessor.name_token(header_name)
-        if name_token[0] == '_':  # these are special
+        module_name = HeaderProcessor.header_modules().get(name_token, None)
+        if module_name is None:
             return
-        if HeaderProcessor.header_aliases.has_key(name_token):
-            name_token = HeaderProcessor.header_aliases[name_token]
         try:
-            module_name = "redbot.message.headers.%s" % name_token
             __import__(module_name)
             return sys.modules[module_name]
-        except (ImportError, KeyError, TypeError):
+        except (ImportError, KeyError):
             return
 
+    @staticmethod
+    def header_modules():
+        """
+        Return a dictionary mapping header name tokens (including aliases) to the names
+        of the modules that handle them. It's built the first time it's needed.
+        """
+        if HeaderProcessor._header_modules is None:
+            modules = {}
+            for loader, name, is_pkg in pkgutil.iter_modules([os.path.dirname(__file__)]):
+                if name[0] != '_' and not is_pkg: # these are special
+                    modules[name] = "redbot.message.headers.%s" % name
+            for alias, name in HeaderProcessor.header_aliases.items():
+                name_token = HeaderProcessor.name_token(name)
+                if modules.has_key(name_token):
+                    modules[HeaderProcessor.name_token(alias)] = modules[name_token]
+            HeaderProcessor._header_modules = modules
+        return HeaderProcessor._header_modules
+
     @staticmethod
     def name_token(header_name):
         """
@@ -307,3 +378,60 @@ class HeaderTest(unittest.TestCase):
 
     def set_context(self, message):
         pass
+
+
+class SyntaxRegistryTest(unittest.TestCase):
+    def test_registry(self):
+        from redbot.message.headers.etag import etag
+        syntax = etag.syntax_re()
+        self.assertTrue(syntax.match(' W/"abc" '))
+        self.assertFalse(syntax.match('abc'))
+        self.assertTrue(etag.syntax_re() is syntax)
+        self.assertEqual(DummyHttpHeader.syntax_re(), None)
+
+
+class HeaderHandlerTest(unittest.TestCase):
+    def test_find(self):
+        from redbot.message.headers.etag import etag
+        from redbot.message.headers.x_pad import x_pad
+        self.assertEqual(HeaderProcessor.find_header_handler("ETag"), etag)
+        self.assertEqual(HeaderProcessor.find_header_handler("X-Pad-For-Netscrape-Bug"), x_pad)
+        self.assertEqual(HeaderProcessor.find_header_handler("X-Unknown"), DummyHttpHeader)
+        self.assertEqual(HeaderProcessor.find_header_handler("X-Unknown", False), None)
+        self.assertEqual(HeaderProcessor.find_header_handler("_utils", False), None)
+        self.assertEqual(HeaderProcessor.find_header_module("x-unknown"), None)
+        classes = HeaderProcessor._header_classes
+        self.assertTrue(classes.has_key(HeaderProcessor.name_token("ETag")))
+        self.assertFalse(classes.has_key(HeaderProcessor.name_token("X-Unknown")))
+
+
+class SplitTest(unittest.TestCase):
+    def test_split_list(self):
+        self.assertEqual(split_list(u'a, "b,c" ,, d ,'), [u'a', u'"b,c"', u'd'])
+        self.assertEqual(split_list(u'a, ,b'), [u'a', u'', u'b'])
+        self.assertEqual(split_list(u'a, "b\\"c", d'), [u'a', u'"b\\"c"', u'd'])
+        self.assertEqual(split_list(u'a, "b, c'), [u'a', u'b', u'c']) # broken quoted-string
+
+
+class ParseCacheTest(unittest.TestCase):
+    def process(self, headers):
+        from redbot.message import DummyMsg
+        message = DummyMsg()
+        message.headers = headers
+        HeaderProcessor(message)
+        return message
+
+    def test_replay(self):
+        from redbot.message.headers import parse_cache
+        headers = [("Cache-Control", "max-age=60, max-age=60, foo"),
+                   ("Set-Cookie", "a=b; Path=/foo")]
+        parse_cache.clear()
+        first = self.process(headers)
+        hits, misses = parse_cache.hits, parse_cache.misses
+        second = self.process(headers)
+        self.assertEqual(parse_cache.hits, hits + 1) # Set-Cookie isn't cached
+        self.assertEqual(parse_cache.misses, misses)
+        self.assertEqual(first.parsed_headers, second.parsed_headers)
+        self.assertEqual([(n.subject, n.vars) for n in first.notes],
+                         [(n.subject, n.vars) for n in second.notes])
+        self.assertEqual(first.note_classes, second.note_classes)
@@ -4,21 +4,65 @@ from email.utils import parsedate as lib_parsedate
 import re
 import urllib
 
-from redbot.syntax import rfc7231
+from redbot.lru import LruCache
+from redbot.syntax import rfc7230, rfc7231, LazyRegex
 from ._notes import *
 
 RE_FLAGS = re.VERBOSE | re.IGNORECASE
+QUOTED_STRING_RE = LazyRegex(rfc7230.quoted_string, re.VERBOSE)
+LIST_ITEM_RE = LazyRegex(r'((?:[^",]|%s)+)(?=%s|\s*$)' % (
+    rfc7230.quoted_string, r"(?:\s*(?:,\s*)+)"), RE_FLAGS)
+_split_res = {} # {(item, split): compiled regex}; see split_string
+HTTP_DATE_RE = LazyRegex(r"^%s$" % rfc7231.HTTP_date, RE_FLAGS)
+OBS_DATE_RE = LazyRegex(r"^%s$" % rfc7231.obs_date, RE_FLAGS)
+IMF_FIXDATE_RE = LazyRegex(r"^(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun), (\d\d) "
+                           r"(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) "
+                           r"(\d{4}) (\d\d):(\d\d):(\d\d) GMT$")
+MONTHS = dict([(month, i + 1) for i, month in enumerate(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"])])
+date_memo = LruCache(1000) # {value: (date or None, [(note, kw)])}; see parse_date
 
 def parse_date(value, add_note):
-    """Parse a HTTP date. Raises ValueError if it's bad."""
-    if not re.match(r"^%s$" % rfc7231.HTTP_date, value, RE_FLAGS):
-        add_note(BAD_DATE_SYNTAX)
-        raise ValueError
-    if re.match(r"^%s$" % rfc7231.obs_date, value, RE_FLAGS):
-        add_note(DATE_OBSOLETE)
-    date_tuple = lib_parsedate(value)
-    if date_tuple is None:
+    """
+    Parse a HTTP date. Raises ValueError if it's bad.
+
+    The results for recently seen values (including the notes they make) are kept in
+    date_memo.
+    """
+    result = date_memo.get(value)
+    if result is None:
+        notes = []
+        try:
+            date = _parse_date(value, lambda note, **kw: notes.append((note, kw)))
+        except ValueError:
+            date = None
+        result = (date, notes)
+        date_memo[value] = result
+    date, notes = result
+    for note, kw in notes:
+        add_note(note, **kw)
+    if date is None:
         raise ValueError
+    return date
+
+def _parse_date(value, add_note):
+    """
+    Parse a HTTP date without memoisation. IMF-fixdates in their canonical form are parsed
+    directly; anything else goes through the full grammar and email.utils.
+    """
+    match = IMF_FIXDATE_RE.match(value)
+    if match:
+        day, month, year, hour, minute, second = match.groups()
+        date_tuple = (int(year), MONTHS[month], int(day), int(hour), int(minute), int(second))
+    else:
+        if not HTTP_DATE_RE.match(value):
+            add_note(BAD_DATE_SYNTAX)
+            raise ValueError
+        if OBS_DATE_RE.match(value):
+            add_note(DATE_OBSOLETE)
+        date_tuple = lib_parsedate(value)
+        if date_tuple is None:
+            raise ValueError
     # http://sourceforge.net/tracker/index.php?func=detail&aid=1194222&group_id=5470&atid=105470
     if date_tuple[0] < 100:
         if date_tuple[0] > 68:
@@ -56,9 +100,51 @@ def split_string(instr, item, split):
     """
     if not instr:
         return []
-    return [h.strip() for h in re.findall(
-        r'%s(?=%s|\s*$)' % (item, split), instr, re.VERBOSE
-    )]
+    try:
+        split_re = _split_res[(item, split)]
+    except KeyError:
+        split_re = re.compile(r'%s(?=%s|\s*$)' % (item, split), re.VERBOSE)
+        _split_res[(item, split)] = split_re
+    return [h.strip() for h in split_re.findall(instr)]
+
+def _split_quoted(instr, delim):
+    """
+    Split instr on delim, except where it's in a quoted-string. Returns None if a DQUOTE
+    doesn't start a valid quoted-string.
+    """
+    if not '"' in instr:
+        return instr.split(delim)
+    pieces = []
+    start = pos = 0
+    while True:
+        split = instr.find(delim, pos)
+        quote = instr.find('"', pos)
+        if quote != -1 and (split == -1 or quote < split):
+            match = QUOTED_STRING_RE.match(instr, quote)
+            if not match:
+                return None
+            pos = match.end()
+        elif split == -1:
+            pieces.append(instr[start:])
+            return pieces
+        else:
+            pieces.append(instr[start:split])
+            start = pos = split + 1
+
+def split_list(instr):
+    """
+    Split a header field value on commas, according to the #rule.
+
+    Well-formed values are split in one pass; if a quoted-string is broken, this falls
+    back to a (much slower) regex that makes what it can of it.
+
+    @param instr: string to be split
+    @return: list of strings
+    """
+    pieces = _split_quoted(instr, ",")
+    if pieces is None:
+        pieces = LIST_ITEM_RE.findall(instr)
+    return [p.strip() for p in pieces if p]
 
 def parse_params(instr, add_note, nostar=None, delim=";"):
     """
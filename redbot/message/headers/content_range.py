@@ -15,6 +15,7 @@ partial body should be applied."""
     deprecated = False
     valid_in_requests = False
     valid_in_responses = True
+    cacheable = False # parse() depends upon the message
 
     def parse(self, field_value, add_note):
         # #53: check syntax, values?
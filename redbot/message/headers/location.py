@@ -20,6 +20,7 @@ In `201 Created``` responses, it identifies a newly created resource."""
     deprecated = False
     valid_in_requests = False
     valid_in_responses = True
+    cacheable = False # parse() depends upon the message
 
     def parse(self, field_value, add_note):
         if self.message.status_code not in ["201", "300", "301", "302", "303", "305", "307", "308"]:
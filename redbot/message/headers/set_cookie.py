@@ -21,6 +21,7 @@ requests to the server."""
     deprecated = False
     valid_in_requests = False
     valid_in_responses = True
+    cacheable = False # parse() depends upon the message
 
     def parse(self, field_value, add_note):
         path = urlsplit(self.message.base_uri).path
@@ -11,14 +11,18 @@ of requests to probe the resource's behaviour.
 See webui.py for the Web front-end.
 """
 
+import unittest
 from urlparse import urljoin
 
 import thor
 
 from redbot.formatter import f_num
 from redbot.message import link_parse
-from redbot.resource.fetch import RedFetcher, UA_STRING
-from redbot.resource import active_check
+from redbot.resource.fetch import RedFetcher, UA_STRING, CancelledError
+from redbot.resource import active_check, fetch
+from redbot.resource.active_check.base import SubRequest
+from redbot.resource.scheduler import CheckScheduler
+from redbot.speak import Note, levels, categories
 
 
 
@@ -33,22 +37,56 @@ class HttpResource(RedFetcher):
     its notes; see that class for details.
     
     if descend is true, the response will be parsed for links and HttpResources started for each
-    link, enumerated in .linked.
+    link, enumerated in .linked. Linked checks start once the response has been parsed, with no
+    more than max_linked of them, most important (according to link_priority) first. They're
+    queued in .link_scheduler, which limits how many run at once; any links beyond max_linked
+    are listed in .skipped_links. If the response fails part-way, the links found before it
+    did are checked the same way; if the check is cancelled, they're listed in .skipped_links.
+
+    If pipeline_checks is true, subordinate requests that only need the response headers are
+    started as soon as they're available, rather than after the body is done. That's quicker,
+    but they run alongside the body's download, so it's off by default.
+
+    if run_active is false, only the response to the request itself is examined; subordinate
+    requests (e.g., the conneg check) aren't made, so their results remain unknown. If
+    light_links is true, linked HttpResources are checked that way.
+
+    cancel() stops the check, along with its subordinate requests and linked resources; what's
+    been found so far is kept. A check is cancelled automatically once it (including its
+    subordinate requests and linked resources) has transferred more than max_transfer bytes,
+    or has run for more than max_runtime seconds.
   
     Emits "done" when everything has finished.
     """
     check_name = u"default"
     response_phrase = u"This response"
-    
-    def __init__(self, uri, method="GET", req_hdrs=None, req_body=None, descend=False):
+    pipeline_checks = False # start header-only subordinate requests before the body is done
+    max_linked = 100 # how many linked resources to check when descending
+    link_priority = { # lower numbers are checked first
+        'link': 0,
+        'script': 1,
+        'frame': 2,
+        'iframe': 2,
+        'img': 3,
+    }
+    max_transfer = None # bytes in and out; None for no limit
+    max_runtime = None # seconds; None for no limit
+
+    def __init__(self, uri, method="GET", req_hdrs=None, req_body=None, descend=False,
+                 run_active=True, light_links=False):
         orig_req_hdrs = req_hdrs or []
         new_req_hdrs = orig_req_hdrs + [(u'Accept-Encoding', u'gzip')]
         RedFetcher.__init__(self, uri, method, new_req_hdrs, req_body)
         self.descend = descend
+        self.run_active = run_active
+        self.light_links = light_links
         self.subreqs = {}  # subordinate requests
         self.links = {}    # {type: set(link...)}
         self.link_count = 0
         self.linked = []   # list of linked HttpResources (if descend=True)
+        self.skipped_links = [] # [(uri, tag)] for links not checked
+        self.link_scheduler = CheckScheduler(ordering="priority")
+        self._link_candidates = [] # [(uri, tag)] to check once the response is parsed
         self.orig_req_hdrs = orig_req_hdrs
         self.partial_support = None
         self.inm_support = None
@@ -56,18 +94,105 @@ class HttpResource(RedFetcher):
         self.gzip_support = None
         self.gzip_savings = 0
         self._outstanding_tasks = 1
+        self.check_transfer = 0 # bytes in and out, including subordinate checks
+        self._cancelling = False
+        self._runtime_ev = None
+        if self.run_active and SubRequest.compare_budget:
+            # keep the start of the body for subrequests to compare theirs with
+            self.response.payload_prefix_size = SubRequest.compare_budget
+        if self.run_active:
+            # digest the body for subrequests to compare theirs with
+            for check in active_check.checks:
+                for body in check.base_digests:
+                    self.response.want_digest(body, check.digester)
+        self.response.on("headers_available", self.header_checks)
         self.response.on("content_available", self.active_checks)
+        if self.descend:
+            self.response.on("content_available", self.check_links)
+            self.on("fetch_done", self.check_partial_links)
         self.on("fetch_done", self.finish_check)
+        self.on("transfer", self._count_transfer)
         self._link_parser = link_parse.HTMLLinkParser(self.response.base_uri,
                                                       [self.process_link])
         self.response.on("chunk", self._link_parser.feed)
 
+    def check(self):
+        if self.max_runtime and not self._runtime_ev:
+            self._runtime_ev = thor.schedule(
+                self.max_runtime, self.cancel,
+                u"it ran for more than %s seconds" % f_num(self.max_runtime))
+        RedFetcher.check(self)
+
+    def cancel(self, reason=None):
+        """
+        Stop the check, including subordinate requests and linked resources (whether or not
+        they've started), and emit "done". Does nothing if the check is already done.
+        """
+        if self._cancelling or self._outstanding_tasks == 0:
+            return
+        self._cancelling = True
+        self.add_note('', CHECK_CANCELLED, reason=reason or u"it was asked to")
+        self.link_scheduler.clear()
+        RedFetcher.cancel(self, reason)
+        for subreq in self.subreqs.values():
+            subreq.cancel(reason)
+        for linked, tag in self.linked:
+            linked.cancel(reason)
+
+    def _count_transfer(self, bytes_in, bytes_out):
+        "Count the bytes transferred for this check; cancel it if there are too many."
+        self.check_transfer += bytes_in + bytes_out
+        if self.max_transfer and self.check_transfer > self.max_transfer:
+            self.cancel(u"it transferred more than %s bytes" % f_num(self.max_transfer))
+
+    def header_checks(self):
+        """
+        Response headers are available; if pipelining, perform the subordinate requests that
+        don't need the body.
+        """
+        if self.pipeline_checks and self.run_active:
+            active_check.start(self, active_check.header_checks)
+
     def active_checks(self):
         """
-        Response is available; perform subordinate requests (e.g., conneg check).
+        Response is available; perform subordinate requests (e.g., conneg check). A truncated
+        response is checked too; the checks take care of what they can't tell from it.
         """
-        if self.response.complete:
-            active_check.start(self)
+        if (self.response.complete or self.response.truncated) and self.run_active:
+            if self.pipeline_checks:
+                active_check.start(self, active_check.body_checks)
+            else:
+                active_check.start(self)
+
+    def check_links(self):
+        """
+        Response has been parsed; check up to max_linked of the links found, most important
+        first.
+        """
+        candidates = sorted(self._link_candidates,
+                            key=lambda (uri, tag): self.link_priority.get(tag, 99))
+        self._link_candidates = []
+        self.skipped_links = candidates[self.max_linked:]
+        for uri, tag in candidates[:self.max_linked]:
+            linked = HttpResource(uri, req_hdrs=self.orig_req_hdrs,
+                                  run_active=not self.light_links)
+            self.linked.append((linked, tag))
+            self.add_check(linked)
+            self.link_scheduler.add(linked, self.link_priority.get(tag, 99))
+
+    def check_partial_links(self):
+        """
+        The fetch is done; if the response didn't get as far as being parsed (e.g., because of
+        an error), check the links that were found before it stopped, unless the check has been
+        cancelled, in which case they're skipped.
+        """
+        if not self._link_candidates:
+            return
+        if self._cancelling:
+            self.skipped_links.extend(self._link_candidates)
+            self._link_candidates = []
+        else:
+            self.check_links()
 
     def add_check(self, *resources):
         "Do a subordinate check on one or more HttpResource instance."
@@ -77,6 +202,7 @@ class HttpResource(RedFetcher):
             @thor.events.on(resource)
             def done():
                 self.finish_check()
+            resource.on("transfer", lambda *args: self.emit("transfer", *args))
 
     def finish_check(self):
         "A subordinate check is done. Was that the last one?"
@@ -86,6 +212,9 @@ class HttpResource(RedFetcher):
             self.check_name or u'?', self._outstanding_tasks))
         assert self._outstanding_tasks >= 0, self._st
         if self._outstanding_tasks == 0:
+            if self._runtime_ev:
+                self._runtime_ev.delete()
+                self._runtime_ev = None
             self.emit('done')
 
     def process_link(self, base, link, tag, title):
@@ -94,18 +223,202 @@ class HttpResource(RedFetcher):
         if not self.links.has_key(tag):
             self.links[tag] = set()
         if self.descend and tag not in ['a'] and link not in self.links[tag]:
-            linked = HttpResource(
-                urljoin(base, link),
-                req_hdrs=self.orig_req_hdrs,
-            )
-            self.linked.append((linked, tag))
-            self.add_check(linked)
-            linked.check()
+            self._link_candidates.append((urljoin(base, link), tag))
         self.links[tag].add(link)
         if not self.response.base_uri:
             self.response.base_uri = base
 
 
+class CHECK_CANCELLED(Note):
+    category = categories.GENERAL
+    level = levels.WARN
+    summary = u"RED stopped checking before it was finished."
+    text = u"""\
+RED stopped this check because %(reason)s. Any requests that were still in progress (including
+those for subordinate checks and linked resources) were abandoned, so some results may be missing
+or incomplete."""
+
+
+class LinkPriorityTest(unittest.TestCase):
+    # links to hosts that can't be converted to URIs, so they finish without fetching
+    bad_host = u"http://%s.example.com/" % (u"a" * 70)
+
+    def test_max_linked(self):
+        resource = HttpResource(u"http://www.example.com/", descend=True)
+        resource.max_linked = 3
+        for tag, name in [('img', 'a.png'), ('a', 'page'), ('img', 'b.png'),
+                          ('script', 'a.js'), ('link', 'a.css'), ('img', 'a.png'),
+                          ('iframe', 'frame')]:
+            resource.process_link(self.bad_host, name, tag, u"")
+        resource.check_links()
+        self.assertEqual([tag for linked, tag in resource.linked], ['link', 'script', 'iframe'])
+        self.assertEqual(resource.skipped_links, [
+            (self.bad_host + u"a.png", 'img'), (self.bad_host + u"b.png", 'img')])
+        self.assertEqual(resource.link_count, 7)
+
+    def test_light_links(self):
+        for light_links in [True, False]:
+            resource = HttpResource(u"http://www.example.com/", descend=True,
+                                    light_links=light_links)
+            resource.process_link(self.bad_host, u"a.png", 'img', u"")
+            resource.check_links()
+            self.assertEqual(resource.linked[0][0].run_active, not light_links)
+
+
+    def test_partial(self):
+        resource = HttpResource(u"http://www.example.com/", descend=True)
+        resource.process_link(self.bad_host, u"a.png", 'img', u"")
+        resource.process_link(self.bad_host, u"a.js", 'script', u"")
+        resource.response.http_error = thor.http.error.ChunkError()
+        resource.emit("fetch_done")
+        self.assertEqual([tag for linked, tag in resource.linked], ['script', 'img'])
+        self.assertEqual(resource.skipped_links, [])
+
+    def test_cancelled(self):
+        resource = HttpResource(u"http://www.example.com/", descend=True)
+        resource.process_link(self.bad_host, u"a.png", 'img', u"")
+        resource.cancel(u"it was tested")
+        self.assertEqual(resource.linked, [])
+        self.assertEqual(resource.skipped_links, [(self.bad_host + u"a.png", 'img')])
+
+
+class PipelineTest(fetch.ServerTest):
+    "Header-only subrequests against a local server with a slow body."
+    def setUp(self):
+        fetch.ServerTest.setUp(self)
+        self.events = []
+
+    def respond(self, x, uri, req_hdrs):
+        if [h for h in req_hdrs if h[0].lower() == 'if-none-match']:
+            self.events.append('inm')
+            self.send(x, "304", "Not Modified", [('ETag', '"abc"')])
+        else:
+            self.events.append('base')
+            x.response_start("200", "OK", [("Content-Length", "10"), ('ETag', '"abc"')])
+            x.response_body("12345")
+            def rest():
+                x.response_body("67890")
+                x.response_done([])
+            thor.schedule(0.5, rest)
+
+    def test_pipeline(self):
+        resource = HttpResource(self.uri())
+        resource.pipeline_checks = True
+        resource.response.on("content_available", lambda: self.events.append('base_done'))
+        self.assertEqual(self.run_check(resource, "done"), 1)
+        self.assertEqual(self.events, ['base', 'inm', 'base_done'])
+        self.assertEqual(resource.inm_support, True)
+
+
+class PartialCompareTest(fetch.ServerTest):
+    "Validation subrequests that get a large, full response stop reading it early."
+    size = 1024 * 1024
+
+    def setUp(self):
+        fetch.ServerTest.setUp(self)
+        self.inm_body = "a" * self.size
+
+    def respond(self, x, uri, req_hdrs):
+        if [h for h in req_hdrs if h[0].lower() == 'if-none-match']:
+            body = self.inm_body
+        else:
+            body = "a" * self.size
+        self.send(x, "200", "OK", [('ETag', '"abc"'),
+                                   ('Last-Modified', 'Thu, 01 Jan 2015 00:00:00 GMT')], body)
+
+    def check(self):
+        resource = HttpResource(self.uri())
+        self.assertEqual(self.run_check(resource, "done"), 1)
+        self.assertTrue(resource.response.complete)
+        subreq = resource.subreqs['ETag Validation']
+        self.assertTrue(subreq.response.truncated)
+        self.assertTrue(subreq.transfer_in < self.size)
+        return resource, [note.__class__.__name__ for note in resource.notes]
+
+    def test_same(self):
+        resource, notes = self.check()
+        self.assertEqual(resource.inm_support, False)
+        self.assertTrue('INM_FULL' in notes)
+        self.assertTrue('PARTIAL_COMPARE' in notes)
+
+    def test_different(self):
+        self.inm_body = "b" * self.size
+        resource, notes = self.check()
+        self.assertEqual(resource.inm_support, None)
+        self.assertTrue('INM_DUP_ETAG_STRONG' in notes)
+        self.assertFalse([note for note in resource.notes if note.subject == 'header-etag'
+                          and note.__class__.__name__ == 'PARTIAL_COMPARE'])
+
+    def test_truncated_base(self):
+        self.size = 2000
+        self.inm_body = "a" * self.size
+        resource, notes = self.check_truncated_base()
+        self.assertEqual(resource.inm_support, False)
+        self.assertEqual(resource.ims_support, False)
+        self.assertTrue('INM_FULL' in notes)
+        self.assertTrue('IMS_FULL' in notes)
+        self.assertTrue('PARTIAL_COMPARE' in notes)
+        self.assertFalse('INM_DUP_ETAG_STRONG' in notes)
+        self.assertFalse('IMS_UNKNOWN' in notes)
+
+    def test_truncated_base_no_budget(self):
+        self.size = 2000
+        self.inm_body = "a" * self.size
+        compare_budget = SubRequest.compare_budget
+        SubRequest.compare_budget = None
+        try:
+            resource, notes = self.check_truncated_base()
+        finally:
+            SubRequest.compare_budget = compare_budget
+        self.assertEqual(resource.inm_support, None)
+        self.assertEqual(resource.ims_support, None)
+        self.assertTrue('NO_COMPARE' in notes)
+        self.assertFalse('INM_FULL' in notes)
+        self.assertFalse('INM_DUP_ETAG_STRONG' in notes)
+        self.assertFalse('IMS_UNKNOWN' in notes)
+
+    def check_truncated_base(self):
+        resource = HttpResource(self.uri())
+        resource.max_payload = 1000
+        self.assertEqual(self.run_check(resource, "done"), 1)
+        self.assertFalse(resource.response.complete)
+        self.assertTrue(resource.response.truncated)
+        notes = [note.__class__.__name__ for note in resource.notes]
+        self.assertTrue('BODY_TRUNCATED' in notes)
+        return resource, notes
+
+
+class CancelTest(fetch.ServerTest):
+    "Budgets cancel checks against a local server."
+    size = 4 * 1024 * 1024
+
+    def respond(self, x, uri, req_hdrs):
+        if uri == "/slow":
+            x.response_start("200", "OK", [("Content-Length", "10")])
+            x.response_body("12345") # ... and the rest never comes.
+        else:
+            self.send(x, "200", "OK", body="a" * self.size)
+
+    def check(self, path, **budget):
+        resource = HttpResource(self.uri(path))
+        for key, value in budget.items():
+            setattr(resource, key, value)
+        self.assertEqual(self.run_check(resource, "done", wait_idle=True), 1)
+        self.assertTrue(isinstance(resource.response.http_error, CancelledError))
+        self.assertTrue('CHECK_CANCELLED' in [n.__class__.__name__ for n in resource.notes])
+        self.assertEqual(self.in_use(resource.client), 0)
+        return resource
+
+    def test_runtime(self):
+        resource = self.check("/slow", max_runtime=1)
+        self.assertEqual(resource.response.payload_len, 5)
+        self.assertEqual(resource.response.decoded_sample, "12345")
+
+    def test_transfer(self):
+        resource = self.check("/", max_transfer=128 * 1024)
+        self.assertTrue(resource.transfer_in < self.size)
+        self.assertFalse(resource.response.complete)
+
 if __name__ == "__main__":
     import sys
     RED = HttpResource(sys.argv[1])
@@ -11,9 +11,11 @@ from redbot.resource.active_check.range import RangeRequest
 from redbot.resource.active_check.etag_validate import ETagValidate
 from redbot.resource.active_check.lm_validate import LmValidate
 
+header_checks = [ConnegCheck, ETagValidate, LmValidate] # only need the response headers
+body_checks = [RangeRequest] # need the response body
 checks = [ConnegCheck, RangeRequest, ETagValidate, LmValidate]
 
-def start(resource):
+def start(resource, checks=checks):
     "Start the active checks."
     check_instances = [ac(resource, ac.check_name) for ac in checks]
     resource.add_check(*check_instances)
@@ -16,10 +16,31 @@ class SubRequest(RedFetcher):
     """
     Base class for a subrequest of a "main" HttpResource, made to perform
     additional behavioural tests on the resource.
+
+    A subrequest can be started before the base response's body is done; its done()
+    isn't called (and it doesn't emit "done") until the base fetch is finished too.
+    If the base response isn't complete (or truncated), done() isn't called.
+
+    If compare_body is true and the subrequest gets a full response with the same status
+    as the base response, its body is compared with the base response's as it arrives. The
+    fetch is stopped (and the response marked truncated) as soon as they differ, or once
+    compare_budget bytes have been compared; use payload_matches() to see the result. If
+    compare_budget is None, the whole body is always fetched, but truncated bodies can't be
+    compared.
+
+    Bodies are compared whole using digests made with digester (see
+    redbot.message.digesters). digests lists which of the subrequest response's bodies
+    ("payload" or "decoded") are digested, and base_digests which of the base response's;
+    the base resource asks for the latter before its body starts.
     """
     check_name = u"undefined"
     response_phrase = u"undefined"
-    
+    compare_body = False
+    compare_budget = 64 * 1024
+    digester = 'crc32'
+    digests = []
+    base_digests = []
+
     def __init__(self, base_resource, name):
         self.base = base_resource
         req_hdrs = self.modify_req_hdrs()
@@ -28,9 +49,15 @@ class SubRequest(RedFetcher):
                             self.base.request.method,
                             req_hdrs,
                             self.base.request.payload)
-        if self.preflight():
+        self._finished = False
+        self._compared = 0 # how many bytes of the body we've compared with the base's
+        if self.compare_body and self.compare_budget:
+            self.response.payload_prefix_size = self.compare_budget
+        for body in self.digests:
+            self.response.want_digest(body, self.digester)
+        self._analyse = self.preflight()
+        if self._analyse:
             self.base.subreqs[name] = self
-            self.on('fetch_done', self.done)
         self.on('fetch_done', self.subrequest_done)
         self.on('status', self.status)
 
@@ -40,7 +67,69 @@ class SubRequest(RedFetcher):
     def done(self):
         raise NotImplementedError
 
+    def _response_body(self, chunk):
+        RedFetcher._response_body(self, chunk)
+        if self.fetch_finished or not self.compare_body or not self.compare_budget \
+          or self.response.status_code != self.base.response.status_code:
+            return
+        prefix = self.response.payload_prefix
+        base_prefix = self.base.response.payload_prefix
+        comparable = min(len(prefix), len(base_prefix))
+        if prefix[self._compared:comparable] != base_prefix[self._compared:comparable] \
+          or (self.base.response.complete and len(prefix) > len(base_prefix)):
+            self.truncate() # they're different.
+        elif self.response.payload_len >= self.compare_budget:
+            self.truncate() # they're the same as far as we're willing to look.
+        else:
+            self._compared = comparable
+
+    def payload_matches(self):
+        """
+        Return whether the response payload is the same as the base response's, or None if
+        that can't be told. If either response is truncated, only the start that both of
+        them have is compared.
+        """
+        res, base_res = self.response, self.base.response
+        if not (res.truncated or base_res.truncated):
+            return self.digests_match('payload', 'payload')
+        prefix, base_prefix = res.payload_prefix, base_res.payload_prefix
+        if (not res.truncated and res.payload_len < len(base_prefix)) \
+          or (not base_res.truncated and base_res.payload_len < len(prefix)):
+            return False # one of them ended before the other.
+        common = min(len(prefix), len(base_prefix))
+        if not common:
+            return None
+        return prefix[:common] == base_prefix[:common]
+
+    def compare_len(self):
+        "Return how many bytes of the payloads payload_matches() compared, if truncated."
+        return min(len(self.response.payload_prefix), len(self.base.response.payload_prefix))
+
+    def digests_match(self, body, base_body):
+        """
+        Return whether the digest of the response's body is the same as that of the base
+        response's base_body.
+        """
+        digest = self.response.digests.get((body, self.digester), None)
+        assert digest is not None, "%s digest of %s wasn't asked for" % (self.digester, body)
+        return digest == self.base.response.digests.get((base_body, self.digester), None)
+
     def subrequest_done(self):
+        "The subrequest is finished; wait for the base fetch if need be."
+        base_res = self.base.response
+        if base_res.complete or base_res.truncated or base_res.http_error:
+            self._finish()
+        else:
+            # not once(); removing listeners while fetch_done is emitted skips some.
+            self.base.on('fetch_done', self._finish)
+
+    def _finish(self):
+        "Both the subrequest and the base fetch are finished."
+        if self._finished:
+            return
+        self._finished = True
+        if self._analyse and (self.base.response.complete or self.base.response.truncated):
+            self.done()
         self.emit("done")
 
     def modify_req_hdrs(self):
@@ -71,6 +160,26 @@ class SubRequest(RedFetcher):
                           subreq_type=subreq_type)
 
 
+class PARTIAL_COMPARE(Note):
+    category = categories.VALIDATION
+    level = levels.INFO
+    summary = u"RED only compared the start of the %(subreq_type)s response's body."
+    text = u"""\
+The response to RED's %(subreq_type)s request had the same status code as the original response,
+so RED compared their bodies to see if it had changed. To save bandwidth, it didn't download all
+of them, and only compared the first %(compare_len)s bytes, which were the same.
+
+If the bodies differ after that point, RED's conclusion about validation support may be wrong."""
+
+class NO_COMPARE(Note):
+    category = categories.VALIDATION
+    level = levels.INFO
+    summary = u"RED couldn't compare the %(subreq_type)s response's body."
+    text = u"""\
+The response to RED's %(subreq_type)s request had the same status code as the original response,
+so RED tried to compare their bodies to see if it had changed. However, it didn't read enough of
+them to do so, so it can't tell whether or not validation is supported."""
+
 class MISSING_HDRS_304(Note):
     category = categories.VALIDATION
     level = levels.WARN
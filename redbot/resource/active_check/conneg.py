@@ -19,7 +19,9 @@ class ConnegCheck(SubRequest):
     """
     check_name = u"Content Negotiation"
     response_phrase = u"The uncompressed response"
-    
+    digests = ['payload']
+    base_digests = ['decoded']
+
     def modify_req_hdrs(self):
         return [h for h in self.base.orig_req_hdrs
                 if h[0].lower() != 'accept-encoding'] + \
@@ -33,7 +35,7 @@ class ConnegCheck(SubRequest):
             return False
 
     def done(self):
-        if not self.response.complete:
+        if not (self.response.complete or self.response.truncated):
             self.add_base_note('', CONNEG_SUBREQ_PROBLEM, problem=self.response.http_error.desc)
             return
 
@@ -66,8 +68,10 @@ class ConnegCheck(SubRequest):
                                    conneg_vary=", ".join(vary_headers),
                                    no_conneg_vary=", ".join(no_conneg_vary_headers))
 
-            # check body
-            if self.base.response.decoded_md5 != self.response.payload_md5:
+            # check body, if we have all of both.
+            truncated = self.response.truncated or self.base.response.truncated
+            if not truncated and not self.base.response.decode_limited \
+              and not self.digests_match('payload', 'decoded'):
                 self.add_base_note('body', VARY_BODY_MISMATCH)
 
             # check ETag
@@ -76,14 +80,17 @@ class ConnegCheck(SubRequest):
                 if not self.base.response.parsed_headers['etag'][0]: # strong
                     self.add_base_note('header-etag', VARY_ETAG_DOESNT_CHANGE)
 
+            self.base.gzip_support = True
+
             # check compression efficiency
+            if truncated:
+                return # can't tell without all of both.
             if self.response.payload_len > 0:
                 savings = int(100 * (
                     (float(self.response.payload_len) - self.base.response.payload_len) \
                     / self.response.payload_len))
             else:
                 savings = 0
-            self.base.gzip_support = True
             self.base.gzip_savings = savings
             if savings >= 0:
                 self.add_base_note('header-content-encoding', CONNEG_GZIP_GOOD,
@@ -5,7 +5,9 @@ Subrequest for ETag validation checks.
 """
 
 
-from redbot.resource.active_check.base import SubRequest, MISSING_HDRS_304
+from redbot.resource.active_check.base import SubRequest, MISSING_HDRS_304, \
+  PARTIAL_COMPARE, NO_COMPARE
+from redbot.formatter import f_num
 from redbot.speak import Note, categories, levels
 
 
@@ -13,6 +15,9 @@ class ETagValidate(SubRequest):
     "If an ETag is present, see if it will validate."
     check_name = u"ETag Validation"
     response_phrase = u"The 304 response"
+    compare_body = True
+    digests = ['payload']
+    base_digests = ['payload']
 
     def modify_req_hdrs(self):
         req_hdrs = list(self.base.request.headers)
@@ -37,7 +42,7 @@ class ETagValidate(SubRequest):
             return False
 
     def done(self):
-        if not self.response.complete:
+        if not (self.response.complete or self.response.truncated):
             self.add_base_note('', ETAG_SUBREQ_PROBLEM, problem=self.response.http_error.desc)
             return
 
@@ -48,9 +53,16 @@ class ETagValidate(SubRequest):
                 'cache-control', 'content-location', 'etag', 'expires', 'vary'
                 ], MISSING_HDRS_304, 'If-None-Match')
         elif self.response.status_code == self.base.response.status_code:
-            if self.response.payload_md5 == self.base.response.payload_md5:
+            matches = self.payload_matches()
+            if matches is None:
+                self.add_base_note('header-etag', NO_COMPARE, subreq_type='If-None-Match')
+            elif matches:
                 self.base.inm_support = False
                 self.add_base_note('header-etag', INM_FULL)
+                if self.response.truncated or self.base.response.truncated:
+                    self.add_base_note('header-etag', PARTIAL_COMPARE,
+                                       subreq_type='If-None-Match',
+                                       compare_len=f_num(self.compare_len()))
             else: # bodies are different
                 if self.base.response.parsed_headers['etag'] == \
                   self.response.parsed_headers.get('etag', 1):
@@ -6,7 +6,9 @@ Subrequest for Last-Modified validation checks.
 
 from datetime import datetime
 
-from redbot.resource.active_check.base import SubRequest, MISSING_HDRS_304
+from redbot.resource.active_check.base import SubRequest, MISSING_HDRS_304, \
+  PARTIAL_COMPARE, NO_COMPARE
+from redbot.formatter import f_num
 from redbot.speak import Note, categories, levels
 
 
@@ -14,6 +16,9 @@ class LmValidate(SubRequest):
     "If Last-Modified is present, see if it will validate."
     check_name = u"Last-Modified Validation"
     response_phrase = u"The 304 response"
+    compare_body = True
+    digests = ['payload']
+    base_digests = ['payload']
     _weekdays = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
     _months = [None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul',
                'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
@@ -45,7 +50,7 @@ class LmValidate(SubRequest):
             return False
 
     def done(self):
-        if not self.response.complete:
+        if not (self.response.complete or self.response.truncated):
             self.add_base_note('', LM_SUBREQ_PROBLEM, problem=self.response.http_error.desc)
             return
 
@@ -56,9 +61,16 @@ class LmValidate(SubRequest):
                 'cache-control', 'content-location', 'etag',
                 'expires', 'vary'], MISSING_HDRS_304, 'If-Modified-Since')
         elif self.response.status_code == self.base.response.status_code:
-            if self.response.payload_md5 == self.base.response.payload_md5:
+            matches = self.payload_matches()
+            if matches is None:
+                self.add_base_note('header-last-modified', NO_COMPARE, subreq_type='If-Modified-Since')
+            elif matches:
                 self.base.ims_support = False
                 self.add_base_note('header-last-modified', IMS_FULL)
+                if self.response.truncated or self.base.response.truncated:
+                    self.add_base_note('header-last-modified', PARTIAL_COMPARE,
+                                       subreq_type='If-Modified-Since',
+                                       compare_len=f_num(self.compare_len()))
             else:
                 self.add_base_note('header-last-modified', IMS_UNKNOWN)
         else:
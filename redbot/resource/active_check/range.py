@@ -47,7 +47,7 @@ class RangeRequest(SubRequest):
             return False
 
     def done(self):
-        if not self.response.complete:
+        if not (self.response.complete or self.response.truncated):
             self.add_base_note('', RANGE_SUBREQ_PROBLEM, problem=self.response.http_error.desc)
             return
 
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+"""
+Check many URIs on one thor loop.
+
+BatchChecker takes an iterator of URIs and keeps a bounded number of HttpResource
+checks running at once, emitting each one as it finishes so that the caller can
+format and discard it.
+
+ShardedBatchChecker spreads the same work over several processes, each running its own
+BatchChecker on its own loop.
+"""
+
+from collections import deque
+import cPickle as pickle
+import multiprocessing
+from Queue import Empty
+import unittest
+
+import thor
+
+from redbot.resource import HttpResource
+from redbot.resource.robot_fetch import url_to_origin
+
+
+class BatchChecker(thor.events.EventEmitter):
+    """
+    Given an iterator of URIs, check each of them with HttpResource.
+
+    Each item can be either a URI or a (URI, req_hdrs) tuple; req_hdrs is used as the
+    default when an item doesn't carry its own headers. If the iterator yields None,
+    no more items are available yet; call check() again to pick up where it left off.
+
+    No more than max_in_flight checks run at once, and no more than max_per_origin
+    checks run against any one origin. Items are only read from the iterator when
+    there's room for them, so memory use doesn't depend upon the number of URIs.
+
+    Emits "result" with each HttpResource and its position in the iterator when its
+    check is done (in completion order), and "done" when the iterator is exhausted and
+    all checks have finished.
+    """
+    resource_class = HttpResource
+    max_in_flight = 10
+    max_per_origin = 2
+
+    def __init__(self, uris, req_hdrs=None, descend=False,
+                 max_in_flight=None, max_per_origin=None):
+        thor.events.EventEmitter.__init__(self)
+        self.uris = iter(uris)
+        self.req_hdrs = req_hdrs or []
+        self.descend = descend
+        if max_in_flight is not None:
+            self.max_in_flight = max_in_flight
+        if max_per_origin is not None:
+            self.max_per_origin = max_per_origin
+        # items read from the iterator whose origin was busy; bounded by max_in_flight
+        self.max_waiting = self.max_in_flight
+        self.in_flight = 0
+        self.started = 0
+        self.finished = 0
+        self._read = 0            # how many items we've read from the iterator
+        self._origin_counts = {}  # origin: number of checks in flight
+        self._waiting = deque()   # (origin, uri, req_hdrs, index)
+        self._exhausted = False
+        self._filling = False
+        self._done = False
+
+    def check(self):
+        "Start checking."
+        self._fill()
+
+    def _fill(self):
+        "Start as many checks as we're allowed to."
+        if self._filling:
+            return  # we're being called from within _fill; it'll pick up the slack.
+        self._filling = True
+        try:
+            while self.in_flight < self.max_in_flight:
+                item = self._next_waiting()
+                if item is None:
+                    if self._exhausted or len(self._waiting) >= self.max_waiting:
+                        break
+                    try:
+                        item = self.uris.next()
+                    except StopIteration:
+                        self._exhausted = True
+                        break
+                    if item is None:
+                        break  # nothing available right now.
+                    item = self._parse_item(item)
+                    if self._origin_counts.get(item[0], 0) >= self.max_per_origin:
+                        self._waiting.append(item)
+                        continue
+                self._start(*item)
+        finally:
+            self._filling = False
+        if self._exhausted and self.in_flight == 0 and not self._waiting and not self._done:
+            self._done = True
+            self.emit("done")
+
+    def _next_waiting(self):
+        "Return the oldest waiting item whose origin has room, or None."
+        for item in self._waiting:
+            if self._origin_counts.get(item[0], 0) < self.max_per_origin:
+                self._waiting.remove(item)
+                return item
+        return None
+
+    def _parse_item(self, item):
+        "Normalise an item from the iterator into (origin, uri, req_hdrs, index)."
+        if isinstance(item, tuple):
+            uri, req_hdrs = item
+        else:
+            uri, req_hdrs = item, self.req_hdrs
+        index = self._read
+        self._read += 1
+        return url_to_origin(uri), uri, list(req_hdrs), index
+
+    def _start(self, origin, uri, req_hdrs, index):
+        "Start checking a URI."
+        self.in_flight += 1
+        self.started += 1
+        self._origin_counts[origin] = self._origin_counts.get(origin, 0) + 1
+        resource = self.resource_class(uri, req_hdrs=req_hdrs, descend=self.descend)
+        resource.once("done", lambda: self._finish(origin, resource, index))
+        resource.check()
+
+    def _finish(self, origin, resource, index):
+        "A check is done."
+        self.in_flight -= 1
+        self.finished += 1
+        self._origin_counts[origin] -= 1
+        if self._origin_counts[origin] == 0:
+            del self._origin_counts[origin]
+        self.emit("result", resource, index)
+        self._fill()
+
+
+class ShardedBatchChecker(object):
+    """
+    Check an iterator of URIs (as for BatchChecker) using a pool of worker processes.
+
+    URIs are sharded across workers by origin, so that each origin's robots.txt and
+    connections stay in one worker. Each worker runs a BatchChecker on its own loop.
+
+    results() yields the HttpResources in the order that their URIs were given. At most
+    window URIs are outstanding at once, which bounds the memory used to reorder them.
+
+    Don't use this from inside a running thor loop; workers are forked from the caller.
+    """
+    poll_interval = 0.1  # seconds between a worker looking for new work
+
+    def __init__(self, uris, req_hdrs=None, descend=False, workers=None,
+                 max_in_flight=None, max_per_origin=None, window=None):
+        self.uris = iter(uris)
+        self.req_hdrs = req_hdrs or []
+        self.descend = descend
+        self.workers = workers or multiprocessing.cpu_count()
+        self.max_in_flight = max_in_flight or BatchChecker.max_in_flight
+        self.max_per_origin = max_per_origin or BatchChecker.max_per_origin
+        self.window = window or self.workers * self.max_in_flight * 4
+
+    def results(self):
+        "Start the workers and yield each checked HttpResource, in order."
+        out_queue = multiprocessing.Queue()
+        in_queues = [multiprocessing.Queue() for i in range(self.workers)]
+        processes = [multiprocessing.Process(
+            target=_batch_worker,
+            args=(in_queue, out_queue, self.req_hdrs, self.descend,
+                  self.max_in_flight, self.max_per_origin)) for in_queue in in_queues]
+        for process in processes:
+            process.daemon = True
+            process.start()
+        pending = {}  # index: resource
+        sent = 0
+        next_index = 0
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and sent - next_index < self.window:
+                    try:
+                        item = self.uris.next()
+                    except StopIteration:
+                        exhausted = True
+                        for in_queue in in_queues:
+                            in_queue.put(None)
+                        break
+                    uri = isinstance(item, tuple) and item[0] or item
+                    shard = hash(url_to_origin(uri)) % self.workers
+                    in_queues[shard].put((sent, item))
+                    sent += 1
+                if exhausted and next_index == sent:
+                    break
+                index, state = self._get_result(out_queue, processes)
+                pending[index] = pickle.loads(state)
+                while pending.has_key(next_index):
+                    yield pending.pop(next_index)
+                    next_index += 1
+        finally:
+            for process in processes:
+                if exhausted and next_index == sent:
+                    process.join()
+                else:
+                    process.terminate()
+
+    @staticmethod
+    def _get_result(out_queue, processes):
+        "Wait for the next result from a worker, noticing if one dies."
+        while True:
+            try:
+                return out_queue.get(timeout=1)
+            except Empty:
+                if [p for p in processes if p.exitcode]:
+                    raise RuntimeError("A batch worker process died.")
+
+
+def _batch_worker(in_queue, out_queue, req_hdrs, descend, max_in_flight, max_per_origin):
+    "Run a BatchChecker in a worker process, fed from in_queue."
+    indices = {}  # local index: index in the parent's iterator
+    def items():
+        "Yield work from the parent, or None when there isn't any yet."
+        local = 0
+        while True:
+            try:
+                work = in_queue.get_nowait()
+            except Empty:
+                yield None
+                continue
+            if work is None:
+                return
+            indices[local], item = work
+            local += 1
+            yield item
+    batch = BatchChecker(items(), req_hdrs, descend, max_in_flight, max_per_origin)
+    @thor.events.on(batch)
+    def result(resource, index):
+        out_queue.put((indices.pop(index), pickle.dumps(resource, -1)))
+    @thor.events.on(batch)
+    def done():
+        thor.stop()
+    def poll():
+        batch.check()
+        if not batch._done:
+            thor.schedule(ShardedBatchChecker.poll_interval, poll)
+    thor.schedule(0, poll)
+    thor.run()
+    out_queue.close()
+    out_queue.join_thread()
+
+
+class BatchCheckerTest(unittest.TestCase):
+    class FakeResource(thor.events.EventEmitter):
+        "Stands in for HttpResource; finishes when told to."
+        def __init__(self, uri, req_hdrs=None, descend=False):
+            thor.events.EventEmitter.__init__(self)
+            self.uri = uri
+            self.req_hdrs = req_hdrs
+        def check(self):
+            BatchCheckerTest.running.append(self)
+
+    running = []
+
+    def setUp(self):
+        BatchCheckerTest.running = []
+        self.results = []
+        self.done = False
+
+    def make_batch(self, uris, **kw):
+        batch = BatchChecker(uris, **kw)
+        batch.resource_class = self.FakeResource
+        batch.on("result", lambda resource, index: self.results.append((index, resource)))
+        @thor.events.on(batch)
+        def done():
+            self.done = True
+        return batch
+
+    def finish(self, resource):
+        BatchCheckerTest.running.remove(resource)
+        resource.emit("done")
+
+    def test_global_cap(self):
+        uris = ("http://host%s.example.com/" % i for i in range(10))
+        batch = self.make_batch(uris, max_in_flight=3)
+        batch.check()
+        self.assertEqual(len(self.running), 3)
+        while self.running:
+            self.assertTrue(len(self.running) <= 3)
+            self.finish(self.running[0])
+        self.assertEqual(len(self.results), 10)
+        self.assertTrue(self.done)
+
+    def test_origin_cap(self):
+        uris = ["http://a.example.com/%s" % i for i in range(4)] + ["http://b.example.com/"]
+        batch = self.make_batch(uris, max_in_flight=4, max_per_origin=2)
+        batch.check()
+        self.assertEqual(
+            [r.uri for r in self.running],
+            ["http://a.example.com/0", "http://a.example.com/1", "http://b.example.com/"])
+        self.finish(self.running[0])
+        self.assertEqual(self.running[-1].uri, "http://a.example.com/2")
+        while self.running:
+            self.finish(self.running[0])
+        self.assertEqual(len(self.results), 5)
+        self.assertTrue(self.done)
+
+    def test_req_hdrs(self):
+        batch = self.make_batch(
+            ["http://a.example.com/", ("http://b.example.com/", [(u"Foo", u"1")])],
+            req_hdrs=[(u"Bar", u"2")])
+        batch.check()
+        self.assertEqual([r.req_hdrs for r in self.running], [[(u"Bar", u"2")], [(u"Foo", u"1")]])
+
+    def test_empty(self):
+        batch = self.make_batch([])
+        batch.check()
+        self.assertTrue(self.done)
+
+    def test_not_yet(self):
+        uris = iter(["http://a.example.com/", None, "http://b.example.com/"])
+        batch = self.make_batch(uris)
+        batch.check()
+        self.assertEqual(len(self.running), 1)
+        batch.check()
+        self.assertEqual(len(self.running), 2)
+        while self.running:
+            self.finish(self.running[0])
+        self.assertEqual(sorted(i for i, r in self.results), [0, 1])
+        self.assertTrue(self.done)
+
+
+class ShardedBatchCheckerTest(unittest.TestCase):
+    def test_order(self):
+        # these can't be converted to URIs, so they finish without touching the network.
+        uris = [(u"http://%s%s.example.com/" % ("a" * 70, i), [(u"X-Index", unicode(i))])
+                for i in range(20)]
+        batch = ShardedBatchChecker(uris, workers=3, max_in_flight=2, window=5)
+        results = [r.orig_req_hdrs[0][1] for r in batch.results()]
+        self.assertEqual(results, [unicode(i) for i in range(20)])
+
+
+if __name__ == "__main__":
+    import sys
+    BATCH = BatchChecker(line.strip() for line in sys.stdin if line.strip())
+    @thor.events.on(BATCH)
+    def result(resource, index):
+        print resource.response.status_code or "-", resource.request.uri
+    @thor.events.on(BATCH)
+    def done():
+        thor.stop()
+    BATCH.check()
+    thor.run()
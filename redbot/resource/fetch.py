@@ -8,10 +8,19 @@ problems and other interesting characteristics. It only makes one request,
 based upon the provided headers.
 """
 
+from collections import defaultdict
+import errno
+import os
+import socket
+import unittest
+
 import thor
+from thor.http.client import HttpClientExchange
+from thor.http.common import ERROR
 import thor.http.error as httperr
 
 from redbot import __version__
+from redbot.formatter import f_num
 from redbot.speak import Note, levels, categories
 from redbot.message import HttpRequest, HttpResponse
 from redbot.message.status import StatusChecker
@@ -22,9 +31,119 @@ from redbot.resource.robot_fetch import RobotFetcher
 UA_STRING = u"RED/%s (https://redbot.org/)" % __version__
 
 class RedHttpClient(thor.http.HttpClient):
-    "Thor HttpClient for RedFetcher"
+    """
+    Thor HttpClient for RedFetcher.
+
+    Connections are kept open for idle_timeout seconds after use, so that the
+    subrequests for a resource can reuse the connection of the main request. No more
+    than max_server_conn connections are opened to an origin; other exchanges wait
+    for one to become free, for up to connect_timeout seconds.
+
+    RedFetcher.client is shared by every fetch in the process, so max_server_conn
+    applies across all of the checks running at once, not to each of them.
+
+    This uses thor's (private) connection pool, so it needs thor 0.2.x.
+    """
     connect_timeout = 10
     read_timeout = 15
+    idle_timeout = 10
+    max_server_conn = 4
+
+    def __init__(self, loop=None):
+        thor.http.HttpClient.__init__(self, loop)
+        for attr in ['connect_timeout', 'read_timeout', 'idle_timeout', 'max_server_conn']:
+            setattr(self, attr, getattr(self.__class__, attr))
+        # origin: [[handle_connect, handle_connect_error, connect_timeout, timeout_ev]]
+        self._conn_waiting = defaultdict(list)
+
+    def exchange(self):
+        return RedHttpClientExchange(self)
+
+    def _attach_conn(self, origin, handle_connect, handle_connect_error, connect_timeout):
+        "Find an idle connection for origin, create a new one, or wait for one."
+        if not self.proxy_host and not self._idle_conns[origin] \
+          and self._conn_counts[origin] >= self.max_server_conn:
+            waiter = [handle_connect, handle_connect_error, connect_timeout, None]
+            if connect_timeout:
+                waiter[3] = self.loop.schedule(connect_timeout, self._wait_timeout, origin, waiter)
+            self._conn_waiting[origin].append(waiter)
+            return
+        thor.http.HttpClient._attach_conn(
+            self, origin, handle_connect, handle_connect_error, connect_timeout)
+
+    def _release_conn(self, tcp_conn, scheme):
+        "Add an idle connection back to the pool, and hand it on if anyone's waiting."
+        thor.http.HttpClient._release_conn(self, tcp_conn, scheme)
+        self._attach_waiting((scheme, tcp_conn.host, tcp_conn.port))
+
+    def _dead_conn(self, origin):
+        "Notify the client that a connect to origin is dead."
+        thor.http.HttpClient._dead_conn(self, origin)
+        self._attach_waiting(origin)
+
+    def _attach_waiting(self, origin):
+        "If an exchange is waiting for a connection to origin and one is available, attach it."
+        waiting = self._conn_waiting.get(origin, None)
+        if waiting and (self._idle_conns[origin] or \
+          self._conn_counts[origin] < self.max_server_conn):
+            handle_connect, handle_connect_error, connect_timeout, timeout_ev = waiting.pop(0)
+            if timeout_ev:
+                timeout_ev.delete()
+            thor.http.HttpClient._attach_conn(
+                self, origin, handle_connect, handle_connect_error, connect_timeout)
+        if not waiting and self._conn_waiting.has_key(origin):
+            del self._conn_waiting[origin]
+
+    def _wait_timeout(self, origin, waiter):
+        "An exchange has waited connect_timeout seconds for a connection to origin; fail it."
+        waiting = self._conn_waiting.get(origin, [])
+        if not [w for w in waiting if w is waiter]:
+            return
+        waiting[:] = [w for w in waiting if w is not waiter]
+        if not waiting:
+            del self._conn_waiting[origin]
+        waiter[1](socket.error, errno.ETIMEDOUT, os.strerror(errno.ETIMEDOUT))
+
+
+class RedHttpClientExchange(HttpClientExchange):
+    """
+    Thor HttpClientExchange that records whether it used an already-open connection,
+    and that can be aborted part-way through the response.
+    """
+    def __init__(self, client):
+        HttpClientExchange.__init__(self, client)
+        self.conn_reused = None
+        self.aborted = False
+
+    def abort(self):
+        """
+        Stop reading the response and drop its connection; no more response events are
+        emitted. Safe to call from a response event handler.
+        """
+        self.aborted = True
+        self.removeListeners('response_start', 'response_body', 'response_done', 'error')
+        self._clear_read_timeout()
+        if self.tcp_conn:
+            self._input_state = ERROR # ignore anything else that's already been read.
+            self.tcp_conn.pause(True)
+        # the parser may still be on the stack, so close the connection once it's unwound.
+        self.client.loop.schedule(0, self._abort_conn)
+
+    def _abort_conn(self):
+        "Close the connection of an aborted exchange, unless the response finished anyway."
+        if self.tcp_conn is None:
+            return
+        self.tcp_conn.close()
+        self.tcp_conn = None
+        self._dead_conn()
+
+    def _handle_connect(self, tcp_conn):
+        if self.aborted: # we got a connection after all; let someone else use it.
+            self.client._release_conn(tcp_conn, self.scheme)
+            return
+        self.conn_reused = getattr(tcp_conn, 'red_conn_used', False)
+        tcp_conn.red_conn_used = True
+        HttpClientExchange._handle_connect(self, tcp_conn)
 
 
 class RedFetcher(thor.events.EventEmitter):
@@ -33,13 +152,21 @@ class RedFetcher(thor.events.EventEmitter):
 
     Fetches the given URI (with the provided method, headers and body) and:
       - emits 'status' as it progresses
+      - emits 'transfer' with the number of bytes read and written as it does so
       - emits 'fetch_done' when the fetch is finished.
 
+    cancel() stops the fetch, finishing it with a CancelledError.
+
     If provided, 'name' indicates the type of the request, and is used to
     help set notes and status events appropriately.
+
+    If max_payload is set, no more than that many bytes of the response body are read; the
+    rest is dropped along with the connection, and the response is marked truncated (but not
+    complete).
     """
     check_name = u"undefined"
     response_phrase = u"undefined"
+    max_payload = None # bytes; None for no limit
     client = RedHttpClient()
     robot_fetcher = RobotFetcher()
 
@@ -58,6 +185,9 @@ class RedFetcher(thor.events.EventEmitter):
         self.response.base_uri = self.request.uri
         self.exchange = None
         self.follow_robots_txt = True # Should we pay attention to robots file?
+        self.fetch_finished = False
+        self.cancelled = False
+        self.on('fetch_done', self._fetch_finished)
         self._st = [] # FIXME: this is temporary, for debugging thor
 
     def __getstate__(self):
@@ -89,6 +219,8 @@ class RedFetcher(thor.events.EventEmitter):
         request is in the status callback.
         """
         self._st.append(u'check')
+        if self.cancelled:
+            return
         if not self.preflight() or self.request.uri == None:
             # generally a good sign that we're not going much further.
             self.emit("fetch_done")
@@ -104,6 +236,8 @@ class RedFetcher(thor.events.EventEmitter):
         """
         Continue after getting the robots file.
         """
+        if self.cancelled:
+            return
         if not allowed:
             self.response.http_error = RobotsTxtError()
             self.emit("fetch_done")
@@ -128,7 +262,7 @@ class RedFetcher(thor.events.EventEmitter):
         self.request.start_time = thor.time()
         if self.request.payload != None:
             self.exchange.request_body(self.request.payload)
-            self.transfer_out += len(self.request.payload)
+            self._transfer(0, len(self.request.payload))
         self.exchange.request_done([])
 
     def _response_start(self, status, phrase, res_headers):
@@ -136,6 +270,7 @@ class RedFetcher(thor.events.EventEmitter):
         self._st.append(u'_response_start(%s, %s)' % (status, phrase))
         self.response.start_time = thor.time()
         self.response.version = self.exchange.res_version
+        self.response.conn_reused = self.exchange.conn_reused
         self.response.status_code = status.decode('iso-8859-1', 'replace')
         self.response.status_phrase = phrase.decode('iso-8859-1', 'replace')
         self.response.set_headers(res_headers)
@@ -144,19 +279,67 @@ class RedFetcher(thor.events.EventEmitter):
 
     def _response_body(self, chunk):
         "Process a chunk of the response body."
-        self.transfer_in += len(chunk)
+        self._transfer(len(chunk), 0)
+        if self.cancelled:
+            return # a transfer budget ran out.
+        if self.max_payload and self.response.payload_len + len(chunk) > self.max_payload:
+            self.response.feed_body(chunk[:self.max_payload - self.response.payload_len])
+            self.add_note('body', BODY_TRUNCATED, max_payload=f_num(self.max_payload))
+            self.truncate()
+            return
         self.response.feed_body(chunk)
 
     def _response_done(self, trailers):
         "Finish analysing the response, handling any parse errors."
         self._st.append(u'_response_done()')
+        self._finish_response(True, trailers)
+
+    def _finish_response(self, complete, trailers):
+        "Finish analysing the response; complete is whether all of its body was read."
         self.response.complete_time = thor.time()
         self.response.transfer_length = self.exchange.input_transfer_length
         self.response.header_length = self.exchange.input_header_length
-        self.response.body_done(True, trailers)
+        self.response.body_done(complete, trailers)
         self.emit("status", "fetched %s (%s)" % (self.request.uri, self.check_name))
         self.emit("fetch_done")
 
+    def _transfer(self, bytes_in, bytes_out):
+        "Account for bytes read and written."
+        self.transfer_in += bytes_in
+        self.transfer_out += bytes_out
+        self.emit("transfer", bytes_in, bytes_out)
+
+    def _fetch_finished(self):
+        self.fetch_finished = True
+
+    def cancel(self, reason=None):
+        """
+        Stop the fetch and drop its connection, finishing it with a CancelledError whose detail
+        is reason. Does nothing if the fetch is already finished.
+        """
+        if self.cancelled or self.fetch_finished:
+            return
+        self._st.append(u'cancel()')
+        self.cancelled = True
+        if self.exchange:
+            self.exchange.abort()
+        self.response.complete_time = thor.time()
+        self.response.http_error = CancelledError(reason)
+        self.emit("status", "cancelled %s (%s)" % (self.request.uri, self.check_name))
+        self.emit("fetch_done")
+
+    def truncate(self):
+        """
+        Stop fetching the response body, and finish the fetch with what's been read so far,
+        marking the response as truncated; it isn't complete. Call from a response body handler.
+        """
+        if self.cancelled or self.fetch_finished:
+            return
+        self._st.append(u'truncate()')
+        self.exchange.abort()
+        self.response.truncated = True
+        self._finish_response(False, [])
+
     def _response_error(self, error):
         "Handle an error encountered while fetching the response."
         self._st.append(u'_response_error(%s)' % (str(error)))
@@ -180,6 +363,23 @@ class RobotsTxtError(httperr.HttpError):
     server_status = ("502", "Gateway Error")
 
 
+class CancelledError(httperr.HttpError):
+    desc = "The check was cancelled"
+    server_status = ("504", "Gateway Timeout")
+
+
+class BODY_TRUNCATED(Note):
+    category = categories.GENERAL
+    level = levels.INFO
+    summary = u"RED didn't read all of %(response)s's body."
+    text = u"""\
+%(response)s's body is larger than RED is willing to download, so it stopped after the first
+%(max_payload)s bytes and closed the connection.
+
+Checks that need the whole body (such as those for `Content-Length`, `Content-MD5` and content
+negotiation) weren't performed, and information about the body only describes the part that was
+read."""
+
 class BODY_NOT_ALLOWED(Note):
     category = categories.CONNECTION
     level = levels.BAD
@@ -215,6 +415,147 @@ This issue is often caused by sending an integer chunk size instead of one in he
 
 
 
+class ServerTest(unittest.TestCase):
+    """
+    Testing machinery for fetches against a local server.
+
+    Subclasses override respond() to answer requests; requests for /robots.txt get a 404.
+    """
+
+    def setUp(self):
+        "Test setup."
+        self.server = thor.http.HttpServer('127.0.0.1', 0)
+        self.port = self.server.tcp_server.sock.getsockname()[1]
+        self.server.on('exchange', self._exchange)
+
+    def tearDown(self):
+        self.server.tcp_server.sock.close()
+
+    def _exchange(self, x):
+        @thor.events.on(x)
+        def request_start(method, uri, req_hdrs):
+            if uri == "/robots.txt":
+                self.send(x, "404", "Not Found")
+            else:
+                self.respond(x, uri, req_hdrs)
+
+    def respond(self, x, uri, req_hdrs):
+        "Respond to a request for uri on exchange x."
+        self.send(x, "404", "Not Found")
+
+    def send(self, x, status, phrase, headers=None, body=""):
+        "Send a complete response on exchange x."
+        x.response_start(status, phrase, [("Content-Length", str(len(body)))] + (headers or []))
+        x.response_body(body)
+        x.response_done([])
+
+    def uri(self, path="/"):
+        "The URI of path on the server."
+        return "http://127.0.0.1:%s%s" % (self.port, path)
+
+    def in_use(self, client):
+        "How many of client's connections to the server aren't idle."
+        origin = ('http', '127.0.0.1', self.port)
+        return client._conn_counts[origin] - len(client._idle_conns[origin])
+
+    def run_check(self, fetcher, done_event="fetch_done", wait_idle=False):
+        """
+        Start fetcher and run the loop until it emits done_event (and, if wait_idle is true,
+        its connections to the server are closed or idle), or five seconds pass. Return how
+        often done_event was emitted.
+        """
+        done = []
+        def stop_when_idle():
+            if not wait_idle or self.in_use(fetcher.client) == 0:
+                thor.stop()
+            else:
+                thor.schedule(0.1, stop_when_idle)
+        def done_handler(*args):
+            done.append(True)
+            stop_when_idle()
+        fetcher.on(done_event, done_handler)
+        fetcher.check()
+        timeout_ev = thor.schedule(5, thor.stop)
+        thor.run()
+        timeout_ev.delete()
+        return len(done)
+
+
+class MaxPayloadTest(ServerTest):
+    "A large body against a local server."
+    def respond(self, x, uri, req_hdrs):
+        self.send(x, "200", "OK", body="a" * 100000)
+
+    def test_truncate(self):
+        fetcher = RedFetcher(self.uri())
+        fetcher.follow_robots_txt = False
+        fetcher.max_payload = 1000
+        self.assertEqual(self.run_check(fetcher), 1)
+        self.assertFalse(fetcher.response.complete)
+        self.assertTrue(fetcher.response.truncated)
+        self.assertEqual(fetcher.response.payload_len, 1000)
+        notes = [n.__class__.__name__ for n in fetcher.notes]
+        self.assertTrue('BODY_TRUNCATED' in notes)
+        self.assertFalse('CL_INCORRECT' in notes)
+
+
+class RedHttpClientTest(ServerTest):
+    "Connection reuse against a local server."
+    def setUp(self):
+        ServerTest.setUp(self)
+        self.client = RedHttpClient()
+        self.client.max_server_conn = 2
+        self.results = []
+
+    def respond(self, x, uri, req_hdrs):
+        if uri == "/hold":
+            x.response_start("200", "OK", [("Content-Length", "10")])
+            x.response_body("12345") # ... and the rest never comes.
+        else:
+            self.send(x, "200", "OK", body="hello")
+
+    def fetcher(self, path):
+        fetcher = RedFetcher(self.uri(path))
+        fetcher.client = self.client
+        fetcher.follow_robots_txt = False
+        return fetcher
+
+    def fetch(self, path, then=None):
+        fetcher = self.fetcher(path)
+        @thor.events.on(fetcher)
+        def fetch_done():
+            self.results.append(fetcher.response.conn_reused)
+            self.assertTrue(self.client._conn_counts.values()[0] <= 2)
+            if then:
+                then()
+            if len(self.results) == 6:
+                thor.stop()
+        fetcher.check()
+
+    def test_reuse(self):
+        def more():
+            for i in range(5):
+                self.fetch("/%s" % i)
+        self.fetch("/", more)
+        thor.schedule(5, thor.stop)
+        thor.run()
+        self.assertEqual(len(self.results), 6)
+        self.assertEqual(self.results[:2], [False, True])
+        self.assertEqual(self.results.count(False), 2)
+
+    def test_wait_timeout(self):
+        self.client.max_server_conn = 1
+        self.client.connect_timeout = 0.5
+        held = self.fetcher("/hold")
+        held.check()
+        waiting = self.fetcher("/")
+        waiting.on("fetch_done", held.cancel)
+        start = thor.time()
+        self.assertEqual(self.run_check(waiting), 1)
+        self.assertTrue(isinstance(waiting.response.http_error, httperr.ConnectError))
+        self.assertTrue(thor.time() - start < 2)
+        self.assertEqual(self.client._conn_waiting, {})
+
 
 if __name__ == "__main__":
     import sys
@@ -6,27 +6,44 @@ RED Robot Fetcher.
 Fetches robots.txt for a given URL.
 """
 
-import hashlib
-from os import path
-from robotparser import RobotFileParser
+import shutil
+import tempfile
+import unittest
 from urlparse import urlsplit
 
 import thor
 
 from redbot import __version__
-from redbot.cache_file import CacheFile
+from redbot.lru import ExpiringLruCache
+from redbot.message import HttpResponse
+from redbot.resource.robot_match import RobotMatcher
+from redbot.resource.robot_store import RobotStore
 
 UA_STRING = u"RED/%s (https://redbot.org/)" % __version__
 
 class RobotFetcher(thor.events.EventEmitter):
     """
     Fetch robots.txt and check to see if we're allowed.
+
+    Checkers for recently seen origins are kept in robot_checkers for as long as the
+    robots.txt response's Cache-Control or Expires header allows (robot_ttl if it doesn't
+    say), but no less than robot_min_ttl and no more than robot_max_ttl seconds.
+
+    If robot_cache_dir is set, robots.txt responses are also kept in a RobotStore there,
+    so that processes sharing it only fetch each one once.
     """
     check_name = u"robot"
     response_phrase = u"The robots.txt response"
     client = thor.http.HttpClient()
-    robot_checkers = {} # cache of robots.txt checkers
-    robot_cache_dir = None
+    robot_checkers = ExpiringLruCache(10000, 64 * 1024 * 1024) # origin: checker; size in bytes
+    robot_ttl = 60 * 30
+    robot_min_ttl = 60
+    robot_max_ttl = 60 * 60 * 24
+    robot_error_ttl = 60 * 5
+    robot_cache_dir = None # where to keep a RobotStore shared with other processes
+    robot_stores = {} # robot_cache_dir: RobotStore
+    robot_lease = 30 # how long other processes wait for one that's fetching robots.txt
+    robot_poll_interval = 0.5 # how often they look to see if it's done
     robot_lookups = {}
 
     def check_robots(self, url, sync=False):
@@ -48,18 +65,17 @@ class RobotFetcher(thor.events.EventEmitter):
             else:
                 self.emit("robot-%s" % url, True)
                 return
-        origin_hash = hashlib.sha1(origin).hexdigest()
-
-        if self.robot_checkers.has_key(origin):
-            # FIXME: freshness lifetime
-            return self._robot_check(url, self.robot_checkers[origin], sync)
+        checker = self.robot_checkers.get(origin)
+        if checker is not None:
+            return self._robot_check(url, checker, sync)
 
-        if self.robot_cache_dir:
-            robot_fd = CacheFile(path.join(self.robot_cache_dir, origin_hash))
-            cached_robots_txt = robot_fd.read()
-            if cached_robots_txt != None:
-                self._load_checker(origin, cached_robots_txt)
-                return self._robot_check(url, self.robot_checkers[origin], sync)
+        store = self._store()
+        if store:
+            stored = store.get(origin, thor.time())
+            if stored != None:
+                robots_txt, status, expires = stored
+                checker = self._load_checker(origin, robots_txt, expires - thor.time())
+                return self._robot_check(url, checker, sync)
 
         if sync:
             return True
@@ -68,50 +84,121 @@ class RobotFetcher(thor.events.EventEmitter):
             self.robot_lookups[origin].add(url)
         else:
             self.robot_lookups[origin] = set([url])
-            exchange = self.client.exchange()
-            @thor.on(exchange)
-            def response_start(status, phrase, headers):
-                exchange.status = status
-
-            exchange.res_body = ""
-            @thor.on(exchange)
-            def response_body(chunk):
-                exchange.res_body += chunk
-
-            @thor.on(exchange)
-            def response_done(trailers):
-                if not exchange.status.startswith("2"):
-                    robots_txt = ""
-                else:
-                    robots_txt = exchange.res_body
-
-                self._load_checker(origin, robots_txt)
-                if self.robot_cache_dir:
-                    robot_fd = CacheFile(path.join(self.robot_cache_dir, origin_hash))
-                    robot_fd.write(robots_txt, 60*30)
-
-                while True:
-                    try:
-                        check_url = self.robot_lookups[origin].pop()
-                    except KeyError:
-                        break
-                    self._robot_check(check_url, self.robot_checkers[origin])
-                del self.robot_lookups[origin]
-
-            p_url = urlsplit(url)
-            robots_url = "%s://%s/robots.txt" % (p_url.scheme, p_url.netloc)
-            exchange.request_start("GET", robots_url, [('User-Agent', UA_STRING)])
-            exchange.request_done([])
-
-    def _load_checker(self, origin, robots_txt):
-        """Load a checker for an origin, given its robots.txt file."""
+            self._fetch_robots(origin, url)
+
+    def _store(self):
+        "Return the RobotStore for robot_cache_dir, or None if there isn't one."
+        if not self.robot_cache_dir:
+            return None
+        if not self.robot_stores.has_key(self.robot_cache_dir):
+            self.robot_stores[self.robot_cache_dir] = RobotStore(self.robot_cache_dir)
+        return self.robot_stores[self.robot_cache_dir]
+
+    def _fetch_robots(self, origin, url):
+        """
+        Fetch the robots.txt for origin (which url is on), unless another process sharing
+        the store already is; if so, wait for it.
+        """
+        store = self._store()
+        if store and not store.claim(origin, self.robot_lease, thor.time()):
+            thor.schedule(self.robot_poll_interval, self._wait_for_robots, origin, url)
+            return
+
+        exchange = self.client.exchange()
+        @thor.on(exchange)
+        def response_start(status, phrase, headers):
+            exchange.status = status
+            exchange.res_hdrs = headers
+
+        exchange.res_hdrs = []
+        exchange.res_body = ""
+        @thor.on(exchange)
+        def response_body(chunk):
+            exchange.res_body += chunk
+
+        @thor.on(exchange)
+        def response_done(trailers):
+            self._robots_done(origin, exchange.status, exchange.res_hdrs, exchange.res_body)
+
+        @thor.on(exchange)
+        def error(err):
+            self._robots_done(origin, None, [], "")
+
+        p_url = urlsplit(url)
+        robots_url = "%s://%s/robots.txt" % (p_url.scheme, p_url.netloc)
+        exchange.request_start("GET", robots_url, [('User-Agent', UA_STRING)])
+        exchange.request_done([])
+
+    def _wait_for_robots(self, origin, url):
+        "Look for the robots.txt that another process is fetching."
+        stored = self._store().get(origin, thor.time())
+        if stored is None:
+            self._fetch_robots(origin, url) # they might have given up
+        else:
+            robots_txt, status, expires = stored
+            self._robots_loaded(origin, robots_txt, expires - thor.time())
+
+    def _robots_done(self, origin, status, headers, body):
+        """
+        Handle the robots.txt response for origin; status is None if it couldn't be fetched.
+
+        If it isn't a 2xx, we act as if there isn't a robots.txt. That's remembered as usual
+        for 3xx and 4xx, but only for robot_error_ttl seconds for 5xx and errors.
+        """
+        if status is None or status.startswith("5"):
+            robots_txt = ""
+            lifetime = self.robot_error_ttl
+        else:
+            robots_txt = status.startswith("2") and body or ""
+            lifetime = self._robots_lifetime(headers)
+        store = self._store()
+        if store:
+            store.put(origin, robots_txt, int(status or 0), thor.time() + lifetime,
+                      thor.time())
+        self._robots_loaded(origin, robots_txt, lifetime)
+
+    def _robots_loaded(self, origin, robots_txt, lifetime):
+        "Check the URLs waiting for origin's robots.txt."
+        checker = self._load_checker(origin, robots_txt, lifetime)
+        for check_url in self.robot_lookups.pop(origin, []):
+            self._robot_check(check_url, checker)
+
+    def _load_checker(self, origin, robots_txt, lifetime):
+        """
+        Load a checker for an origin, given its robots.txt file, and keep it for lifetime
+        seconds. Returns the checker.
+        """
         if robots_txt == "": # empty or non-200
             checker = DummyChecker()
         else:
-            checker = RobotFileParser()
-            checker.parse(
+            checker = RobotMatcher(
                 robots_txt.decode('ascii', 'replace').encode('ascii', 'replace').splitlines())
-        self.robot_checkers[origin] = checker
+        # a compiled robots.txt takes about sixteen times as much memory as its text.
+        self.robot_checkers.set(origin, checker, thor.time() + lifetime,
+                                1024 + 16 * len(robots_txt))
+        return checker
+
+    def _robots_lifetime(self, headers):
+        """
+        Return how many seconds a robots.txt response with headers can be used for, using
+        the same rules as checkCaching().
+        """
+        response = HttpResponse(lambda subject, note, **kw: None)
+        response.set_headers(headers)
+        cc_dict = dict(response.parsed_headers.get('cache-control', []))
+        if cc_dict.has_key('no-store') or cc_dict.has_key('no-cache'):
+            lifetime = 0
+        elif cc_dict.has_key('s-maxage'):
+            lifetime = cc_dict['s-maxage']
+        elif cc_dict.has_key('max-age'):
+            lifetime = cc_dict['max-age']
+        elif response.parsed_headers.has_key('expires'):
+            # An invalid Expires header means it's already stale
+            lifetime = (response.parsed_headers['expires'] or 0) - \
+              (response.parsed_headers.get('date', None) or thor.time())
+        else:
+            return self.robot_ttl
+        return min(max(lifetime, self.robot_min_ttl), self.robot_max_ttl)
 
     def _robot_check(self, url, robots_checker, sync=False):
         """Continue after getting the robots file."""
@@ -142,3 +229,69 @@ class DummyChecker(object):
     """Dummy checker for non-200 or empty responses."""
     def can_fetch(self, ua_string, url):
         return True
+
+
+class RobotFetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.fetcher = RobotFetcher()
+        self.fetcher.robot_checkers = ExpiringLruCache(10, 100000)
+
+    def test_lifetime(self):
+        lifetime = self.fetcher._robots_lifetime
+        self.assertEqual(lifetime([]), RobotFetcher.robot_ttl)
+        self.assertEqual(lifetime([("Cache-Control", "public, max-age=3600")]), 3600)
+        self.assertEqual(lifetime([("cache-control", 'max-age=600, s-maxage="7200"')]), 7200)
+        self.assertEqual(lifetime([("Cache-Control", "max-age=3600, no-cache")]),
+                         RobotFetcher.robot_min_ttl)
+        self.assertEqual(lifetime([("Cache-Control", "max-age=99999999")]),
+                         RobotFetcher.robot_max_ttl)
+        self.assertEqual(lifetime([("Cache-Control", "max-age=foo")]), RobotFetcher.robot_ttl)
+        self.assertEqual(lifetime([("Cache-Control", "MAX-AGE=3600")]), 3600)
+        self.assertEqual(lifetime([("Date", "Tue, 15 Nov 1994 08:12:31 GMT"),
+                                   ("Expires", "Tue, 15 Nov 1994 10:12:31 GMT")]), 7200)
+        self.assertEqual(lifetime([("Expires", "0")]), RobotFetcher.robot_min_ttl)
+
+    def test_cached(self):
+        self.fetcher._load_checker("http://a.example.com:80", "User-agent: *\nDisallow: /\n",
+                                   60)
+        self.assertFalse(self.fetcher.check_robots("http://a.example.com/", sync=True))
+        self.assertTrue(self.fetcher.check_robots("http://b.example.com/", sync=True))
+        self.fetcher._load_checker("http://a.example.com:80", "User-agent: *\nDisallow: /\n",
+                                   -1)
+        self.assertTrue(self.fetcher.check_robots("http://a.example.com/", sync=True))
+        self.assertEqual(self.fetcher.robot_checkers.expirations, 1)
+
+    def test_store(self):
+        store_dir = tempfile.mkdtemp()
+        try:
+            self.fetcher.robot_cache_dir = store_dir
+            store = self.fetcher._store()
+            store.put("http://a.example.com:80", "User-agent: *\nDisallow: /\n", 200,
+                      thor.time() + 60)
+            self.assertFalse(self.fetcher.check_robots("http://a.example.com/", sync=True))
+            self.assertTrue(self.fetcher.robot_checkers.get("http://a.example.com:80"))
+
+            store.put("http://b.example.com:80", "User-agent: *\nDisallow: /b\n", 200,
+                      thor.time() + 60)
+            results = []
+            self.fetcher.robot_lookups = {
+                "http://b.example.com:80": set(["http://b.example.com/b"])}
+            self.fetcher.on("robot-http://b.example.com/b", results.append)
+            self.fetcher._wait_for_robots("http://b.example.com:80", "http://b.example.com/b")
+            self.assertEqual(results, [False])
+            self.assertEqual(self.fetcher.robot_lookups, {})
+
+            self.fetcher._robots_done("http://c.example.com:80", "404",
+                                      [("Cache-Control", "max-age=3600")], "Not found")
+            self.fetcher._robots_done("http://d.example.com:80", "503", [], "")
+            self.fetcher._robots_done("http://e.example.com:80", None, [], "")
+            now = thor.time()
+            for origin, status, lifetime in [("http://c.example.com:80", 404, 3600),
+                                             ("http://d.example.com:80", 503, 300),
+                                             ("http://e.example.com:80", 0, 300)]:
+                robots_txt, stored_status, expires = store.get(origin, now)
+                self.assertEqual((robots_txt, stored_status), ("", status))
+                self.assertAlmostEqual(expires, now + lifetime, delta=5)
+                self.assertFalse(store.claim(origin, 30, now))
+        finally:
+            shutil.rmtree(store_dir)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""
+Compiled robots.txt matching.
+
+RobotFileParser checks a URL by trying each rule for the user-agent in turn, so checking
+many URLs on a site with a long robots.txt is slow. RobotMatcher makes the same decisions,
+but compiles the rules for each user-agent the first time they're needed, so that the cost
+of a check depends upon the length of the URL, not the number of rules.
+"""
+
+import random
+import re
+from robotparser import RobotFileParser, Entry, RuleLine
+import unittest
+import urllib
+import urlparse
+
+
+class RobotMatcher(RobotFileParser):
+    """
+    A RobotFileParser whose rules for each user-agent are compiled (into RobotRules) the
+    first time they're needed.
+
+    If wildcards is true, "*" in a rule's path matches any characters and a "$" at its end
+    anchors it, as most crawlers do; RobotFileParser takes them literally, so they never
+    match.
+    """
+    wildcards = True
+
+    def __init__(self, lines, wildcards=None):
+        RobotFileParser.__init__(self)
+        if wildcards is not None:
+            self.wildcards = wildcards
+        self._rules = {} # useragent: RobotRules
+        self.parse(lines)
+
+    def parse(self, lines):
+        """
+        Parse the lines of a robots.txt file, just as RobotFileParser does, but remember the
+        (unquoted) path that each rule was given as in its "value" attribute.
+        """
+        # states:
+        #   0: start state
+        #   1: saw user-agent line
+        #   2: saw an allow or disallow line
+        state = 0
+        entry = Entry()
+        self.modified()
+        self._rules = {}
+        for line in lines:
+            if not line:
+                if state == 1:
+                    entry = Entry()
+                    state = 0
+                elif state == 2:
+                    self._add_entry(entry)
+                    entry = Entry()
+                    state = 0
+            # remove optional comment and strip line
+            i = line.find('#')
+            if i >= 0:
+                line = line[:i]
+            line = line.strip()
+            if not line:
+                continue
+            line = line.split(':', 1)
+            if len(line) == 2:
+                line[0] = line[0].strip().lower()
+                line[1] = urllib.unquote(line[1].strip())
+                if line[0] == "user-agent":
+                    if state == 2:
+                        self._add_entry(entry)
+                        entry = Entry()
+                    entry.useragents.append(line[1])
+                    state = 1
+                elif line[0] in ["disallow", "allow"]:
+                    if state != 0:
+                        rule = RuleLine(line[1], line[0] == "allow")
+                        rule.value = line[1]
+                        entry.rulelines.append(rule)
+                        state = 2
+        if state == 2:
+            self._add_entry(entry)
+
+    def can_fetch(self, useragent, url):
+        "Return whether useragent can fetch url."
+        rules = self._rules.get(useragent, None)
+        if rules is None:
+            rules = self._rules[useragent] = RobotRules(self._entry(useragent), self.wildcards)
+        return rules.allowance(normalise_url(url))
+
+    def _entry(self, useragent):
+        "Return the Entry for useragent, or None if there isn't one."
+        for entry in self.entries:
+            if entry.applies_to(useragent):
+                return entry
+        return self.default_entry
+
+
+class RobotRules(object):
+    """
+    The rules in a robots.txt Entry, compiled.
+
+    The first rule whose path is a prefix of the URL wins. Rather than trying them in order,
+    the paths of the rules are kept in a dictionary, and each prefix of the URL with one of
+    their lengths is looked up in it; the earliest rule found wins. Rules with wildcards are
+    compiled into regexes, and are only tried if they're earlier than that.
+    """
+    def __init__(self, entry, wildcards=True):
+        self.default = True         # the allowance when no rule matches
+        self.default_index = 0      # no rule from this one on can win
+        self.prefixes = {}          # path: (index, allowance) of its first rule
+        self.lengths = []           # the lengths of prefixes' paths, in order
+        self.patterns = []          # (index, allowance, regex) for wildcard rules, in order
+        rulelines = entry and entry.rulelines or []
+        for index, rule in enumerate(rulelines):
+            self.default_index = index
+            if rule.path in ["*", ""]: # matches everything
+                self.default = rule.allowance
+                break
+            value = getattr(rule, "value", None)
+            if wildcards and value and ("*" in value or value.endswith("$")):
+                self.patterns.append((index, rule.allowance, self._pattern(value)))
+            elif not self.prefixes.has_key(rule.path):
+                self.prefixes[rule.path] = (index, rule.allowance)
+        else:
+            self.default_index = len(rulelines)
+        self.lengths = sorted(set([len(path) for path in self.prefixes]))
+
+    @staticmethod
+    def _pattern(value):
+        "Compile a rule's (unquoted) path with wildcards into a regex."
+        anchored = value.endswith("$")
+        if anchored:
+            value = value[:-1]
+        regex = ".*".join([re.escape(urllib.quote(piece)) for piece in value.split("*")])
+        return re.compile(regex + (anchored and r"\Z" or ""), re.DOTALL)
+
+    def allowance(self, filename):
+        "Return whether filename (a normalised URL; see normalise_url) is allowed."
+        best, allowance = self.default_index, self.default
+        get = self.prefixes.get
+        for length in self.lengths:
+            if length > len(filename):
+                break
+            rule = get(filename[:length], None)
+            if rule is not None and rule[0] < best:
+                best, allowance = rule
+        for index, rule_allowance, regex in self.patterns:
+            if index >= best:
+                break
+            if regex.match(filename):
+                return rule_allowance
+        return allowance
+
+
+def normalise_url(url):
+    "Normalise url for comparison with rules' paths, as RobotFileParser.can_fetch does."
+    parsed_url = urlparse.urlparse(urllib.unquote(url))
+    url = urlparse.urlunparse(('', '', parsed_url.path, parsed_url.params,
+                               parsed_url.query, parsed_url.fragment))
+    return urllib.quote(url) or "/"
+
+
+class RobotMatcherTest(unittest.TestCase):
+    agents = ["*", "red", "RED", "Red/1.0", "googlebot", "e", "", "other"]
+    paths = ["/", "/a", "/ab", "/a/b", "/b", "/%61", "/a%2F", "/~x", "/a;p", "/a?q", "/a?",
+             "/a#f", "/\xc3\xa9", "/%C3%A9", "a", " /a", "/a b", "*", "/*", "/a*", "/*b",
+             "/a$", "$", "/a*$", "/%2A", "/*/b"]
+    useragents = ["RED/1.0 (https://redbot.org/)", "Googlebot/2.1", "other", "*"]
+
+    def robots_txts(self, count, paths):
+        "Generate count random robots.txt files with rules from paths."
+        rand = random.Random(9309)
+        for i in xrange(count):
+            lines = []
+            for j in xrange(rand.randint(0, 25)):
+                kind = rand.random()
+                if kind < 0.2:
+                    lines.append("User-agent: %s" % rand.choice(self.agents))
+                elif kind < 0.7:
+                    lines.append("%s: %s" % (rand.choice(["Disallow", "disallow", "Allow"]),
+                                             rand.choice(paths + [""])))
+                elif kind < 0.8:
+                    lines.append(rand.choice(["", "  ", "# comment", "Sitemap: /s.xml"]))
+                else:
+                    lines.append("%s:%s # c" % (rand.choice(["Disallow", "Allow"]),
+                                                rand.choice(paths)))
+            yield lines
+
+    def urls(self, paths):
+        for path in paths + ["", "/a/b/c", "/ab?x=1#y", "/a%3Bp"]:
+            yield "http://www.example.com%s" % path.replace(" ", "%20")
+
+    def parser(self, lines):
+        parser = RobotFileParser()
+        parser.parse(lines)
+        return parser
+
+    def assertSame(self, lines, matcher, urls):
+        parser = self.parser(lines)
+        for useragent in self.useragents:
+            for url in urls:
+                self.assertEqual(matcher.can_fetch(useragent, url),
+                                 parser.can_fetch(useragent, url),
+                                 "%r %r\n%s" % (useragent, url, "\n".join(lines)))
+
+    def test_same_as_robotparser(self):
+        urls = list(self.urls(self.paths))
+        for lines in self.robots_txts(500, self.paths):
+            self.assertSame(lines, RobotMatcher(lines, wildcards=False), urls)
+            self.assertEqual(str(RobotMatcher(lines)), str(self.parser(lines)))
+
+    def test_same_without_wildcards(self):
+        paths = [p for p in self.paths if "*" not in p and "$" not in p and "%2A" not in p]
+        urls = list(self.urls(self.paths))
+        for lines in self.robots_txts(200, paths):
+            self.assertSame(lines, RobotMatcher(lines), urls)
+
+    def test_wildcards(self):
+        matcher = RobotMatcher(["User-agent: *", "Allow: /*.css$", "Disallow: /*?",
+                                "Disallow: /private*/", "Disallow: /*.css"])
+        for path, expected in [
+            ("/a.css", True),
+            ("/a.css?v=1", False),
+            ("/a.cssx", False),
+            ("/private/", False),
+            ("/privatefoo/bar", False),
+            ("/private", True),
+            ("/public/", True),
+        ]:
+            self.assertEqual(matcher.can_fetch("RED", "http://www.example.com" + path),
+                             expected, path)
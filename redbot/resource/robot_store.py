@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+A robots.txt store shared by processes.
+"""
+
+import os
+from os import path
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+
+class RobotStore(object):
+    """
+    robots.txt responses, kept in a sqlite database (in WAL mode, so that readers don't
+    wait for writers) in directory, so that all of the processes using it can share them.
+
+    Each origin has the robots.txt text (empty if there wasn't a usable one), the status
+    code of the response, when it was fetched and when it expires. So that only one process
+    fetches a given origin's robots.txt, claim() takes a lease on it; the others wait until
+    the result is put() (or the lease runs out).
+
+    Errors are discarded; the store is just a cache, so it's treated as empty.
+    """
+    db_name = "robots.sqlite"
+    timeout = 5 # seconds to wait for another process's write to finish
+    purge_interval = 1000 # how many puts between removing expired robots.txt
+
+    def __init__(self, directory):
+        self.path = path.join(directory, self.db_name)
+        self._db = None
+        self._pid = None
+        self._puts = 0
+
+    def _conn(self):
+        "Return a connection to the database; each process needs its own."
+        if self._db is None or self._pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS robots (
+                origin TEXT PRIMARY KEY,
+                robots_txt BLOB NOT NULL,
+                status INTEGER NOT NULL,
+                fetched REAL NOT NULL,
+                expires REAL NOT NULL)""")
+            db.execute("""CREATE TABLE IF NOT EXISTS leases (
+                origin TEXT PRIMARY KEY,
+                expires REAL NOT NULL)""")
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    def get(self, origin, now=None):
+        """
+        Return (robots_txt, status, expires) for origin if there's a fresh one, or None.
+        """
+        try:
+            row = self._conn().execute(
+                "SELECT robots_txt, status, expires FROM robots WHERE origin = ? AND expires > ?",
+                (origin, now or time.time())).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        return str(row[0]), row[1], row[2]
+
+    def put(self, origin, robots_txt, status, expires, now=None):
+        "Store the robots.txt for origin, and let go of any lease on it."
+        now = now or time.time()
+        self._puts += 1
+        try:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute("INSERT OR REPLACE INTO robots VALUES (?, ?, ?, ?, ?)",
+                           (origin, buffer(robots_txt), status, now, expires))
+                db.execute("DELETE FROM leases WHERE origin = ?", (origin,))
+                if self._puts % self.purge_interval == 0:
+                    db.execute("DELETE FROM robots WHERE expires <= ?", (now,))
+                    db.execute("DELETE FROM leases WHERE expires <= ?", (now,))
+                db.execute("COMMIT")
+            except:
+                db.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            pass
+
+    def claim(self, origin, lease, now=None):
+        """
+        Try to become the process that fetches the robots.txt for origin, for the next lease
+        seconds. Returns False if another process already is, or if a fresh one has been
+        stored since get() was called.
+        """
+        now = now or time.time()
+        try:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                claimed = db.execute(
+                    "SELECT 1 FROM robots WHERE origin = ? AND expires > ? UNION ALL "
+                    "SELECT 1 FROM leases WHERE origin = ? AND expires > ?",
+                    (origin, now, origin, now)).fetchone() is None
+                if claimed:
+                    db.execute("INSERT OR REPLACE INTO leases VALUES (?, ?)",
+                               (origin, now + lease))
+                db.execute("COMMIT")
+            except:
+                db.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            return True # fetch it ourselves
+        return claimed
+
+
+def _claim_worker(directory, origin, results):
+    "Try to claim origin in another process."
+    results.put(RobotStore(directory).claim(origin, 30))
+
+
+class RobotStoreTest(unittest.TestCase):
+    origin = "http://www.example.com:80"
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = RobotStore(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_put_get(self):
+        self.assertEqual(self.store.get(self.origin), None)
+        self.store.put(self.origin, "User-agent: *\nDisallow: /\n", 200, 2000, now=1000)
+        self.assertEqual(self.store.get(self.origin, now=1999),
+                         ("User-agent: *\nDisallow: /\n", 200, 2000))
+        self.assertEqual(self.store.get(self.origin, now=2000), None)
+        self.store.put(self.origin, "", 503, 3000, now=2500)
+        self.assertEqual(RobotStore(self.dir).get(self.origin, now=2600), ("", 503, 3000))
+
+    def test_claim(self):
+        self.assertTrue(self.store.claim(self.origin, 30, now=1000))
+        self.assertFalse(self.store.claim(self.origin, 30, now=1010))
+        self.assertTrue(self.store.claim(self.origin, 30, now=1031)) # the lease ran out
+        self.store.put(self.origin, "", 404, 2000, now=1040)
+        self.assertFalse(self.store.claim(self.origin, 30, now=1050)) # it's fresh
+        self.assertTrue(self.store.claim(self.origin, 30, now=2001))
+
+    def test_purge(self):
+        self.store.purge_interval = 2
+        self.store.put("http://a.example.com:80", "", 404, 1500, now=1000)
+        self.store.put("http://b.example.com:80", "", 404, 3000, now=2000)
+        self.assertEqual(self.store._conn().execute("SELECT origin FROM robots").fetchall(),
+                         [(u"http://b.example.com:80",)])
+
+    def test_errors(self):
+        store = RobotStore(path.join(self.dir, "missing"))
+        self.assertEqual(store.get(self.origin), None)
+        store.put(self.origin, "", 404, 2000)
+        self.assertTrue(store.claim(self.origin, 30))
+
+    def test_processes(self):
+        import multiprocessing # only needed here, and slow to import
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_claim_worker,
+                                           args=(self.dir, self.origin, results))
+                   for i in range(6)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(sorted([results.get() for worker in workers]), [False] * 5 + [True])
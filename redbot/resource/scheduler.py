@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+"""
+Politely schedule checks against a set of origins.
+"""
+
+import heapq
+import unittest
+
+import thor
+
+from redbot.resource.robot_fetch import url_to_origin
+
+
+class CheckScheduler(object):
+    """
+    Start checks (e.g., HttpResources) so that no more than max_in_flight are running
+    at once, and no more than max_per_origin are running against any one origin.
+
+    Checks wait in a queue until there's room. If ordering is "fifo", they're started
+    in the order they were added; if it's "priority", lower priority numbers go first,
+    and checks with the same priority are started in the order they were added.
+
+    A check is finished when it emits "done".
+    """
+    max_in_flight = 8
+    max_per_origin = 4
+    ordering = "fifo"
+
+    def __init__(self, max_in_flight=None, max_per_origin=None, ordering=None):
+        if max_in_flight is not None:
+            self.max_in_flight = max_in_flight
+        if max_per_origin is not None:
+            self.max_per_origin = max_per_origin
+        if ordering is not None:
+            self.ordering = ordering
+        assert self.ordering in ["fifo", "priority"], self.ordering
+        self.in_flight = 0
+        self.queued = 0
+        self._queues = {}         # origin: heap of (priority, seq, check)
+        self._origin_counts = {}  # origin: number of checks in flight
+        self._seq = 0
+        self._running = False
+
+    def add(self, check, priority=0):
+        "Queue a check, starting it if there's room."
+        if self.ordering == "fifo":
+            priority = 0
+        origin = url_to_origin(check.request.uri)
+        heapq.heappush(self._queues.setdefault(origin, []), (priority, self._seq, check))
+        self._seq += 1
+        self.queued += 1
+        self._run()
+
+    def clear(self):
+        "Forget the checks that are waiting to start; those in flight keep running."
+        self._queues = {}
+        self.queued = 0
+
+    def _run(self):
+        "Start as many queued checks as we're allowed to."
+        if self._running:
+            return  # we're being called from within _run; it'll pick up the slack.
+        self._running = True
+        try:
+            while self.in_flight < self.max_in_flight:
+                origin = self._next_origin()
+                if origin is False:
+                    break
+                priority, seq, check = heapq.heappop(self._queues[origin])
+                if not self._queues[origin]:
+                    del self._queues[origin]
+                self._start(origin, check)
+        finally:
+            self._running = False
+
+    def _next_origin(self):
+        "Return the origin of the next check to start, or False if none can be."
+        best = None
+        best_origin = False
+        for origin, queue in self._queues.items():
+            if self._origin_counts.get(origin, 0) >= self.max_per_origin:
+                continue
+            if best is None or queue[0][:2] < best:
+                best = queue[0][:2]
+                best_origin = origin
+        return best_origin
+
+    def _start(self, origin, check):
+        "Start a check."
+        self.queued -= 1
+        self.in_flight += 1
+        self._origin_counts[origin] = self._origin_counts.get(origin, 0) + 1
+        check.once("done", lambda: self._finish(origin))
+        check.check()
+
+    def _finish(self, origin):
+        "A check is done."
+        self.in_flight -= 1
+        self._origin_counts[origin] -= 1
+        if self._origin_counts[origin] == 0:
+            del self._origin_counts[origin]
+        self._run()
+
+
+class CheckSchedulerTest(unittest.TestCase):
+    class FakeCheck(thor.events.EventEmitter):
+        "Stands in for HttpResource; finishes when told to."
+        def __init__(self, uri, running):
+            thor.events.EventEmitter.__init__(self)
+            self.request = self
+            self.uri = uri
+            self.running = running
+        def check(self):
+            self.running.append(self)
+
+    def setUp(self):
+        self.running = []
+
+    def add(self, scheduler, uri, priority=0):
+        scheduler.add(self.FakeCheck(uri, self.running), priority)
+
+    def finish(self, check):
+        self.running.remove(check)
+        check.emit("done")
+
+    def test_limits(self):
+        scheduler = CheckScheduler(max_in_flight=3, max_per_origin=2)
+        for i in range(4):
+            self.add(scheduler, "http://a.example.com/%s" % i)
+        self.add(scheduler, "http://b.example.com/")
+        self.add(scheduler, "http://c.example.com/")
+        self.assertEqual(
+            [c.uri for c in self.running],
+            ["http://a.example.com/0", "http://a.example.com/1", "http://b.example.com/"])
+        self.finish(self.running[0])
+        self.assertEqual(self.running[-1].uri, "http://a.example.com/2")
+        self.finish(self.running[1])
+        self.assertEqual(self.running[-1].uri, "http://c.example.com/")
+        while self.running:
+            self.finish(self.running[0])
+        self.assertEqual(scheduler.in_flight, 0)
+        self.assertEqual(scheduler.queued, 0)
+
+    def test_priority(self):
+        scheduler = CheckScheduler(max_in_flight=1, ordering="priority")
+        self.add(scheduler, "http://a.example.com/first", 5)
+        self.add(scheduler, "http://a.example.com/low", 9)
+        self.add(scheduler, "http://b.example.com/high", 1)
+        self.add(scheduler, "http://a.example.com/high", 1)
+        order = []
+        while self.running:
+            order.append(self.running[0].uri)
+            self.finish(self.running[0])
+        self.assertEqual(order, [
+            "http://a.example.com/first", "http://b.example.com/high",
+            "http://a.example.com/high", "http://a.example.com/low"])
+
+    def test_fifo(self):
+        scheduler = CheckScheduler(max_in_flight=1)
+        self.add(scheduler, "http://a.example.com/1", 5)
+        self.add(scheduler, "http://a.example.com/2", 1)
+        self.assertEqual(scheduler.queued, 1)
+        self.finish(self.running[0])
+        self.assertEqual(self.running[0].uri, "http://a.example.com/2")
+
+    def test_clear(self):
+        scheduler = CheckScheduler(max_in_flight=1)
+        self.add(scheduler, "http://a.example.com/1")
+        self.add(scheduler, "http://a.example.com/2")
+        scheduler.clear()
+        self.assertEqual(scheduler.queued, 0)
+        self.finish(self.running[0])
+        self.assertEqual(self.running, [])
+        self.assertEqual(scheduler.in_flight, 0)
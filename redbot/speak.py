@@ -9,7 +9,6 @@ it need to be escaped to be safe for use in HTML.
 """
 
 from cgi import escape as e_html
-from markdown import markdown
 
 class _Categories(object):
     "Note classifications."
@@ -66,6 +65,7 @@ class Note(object):
 
         The resulting string is already HTML-encoded.
         """
+        from markdown import markdown # it's slow to import, and often not needed.
         return markdown(self.text % dict(
             [(k, e_html(unicode(v), True)) for k, v in self.vars.items()]
         ), output_format="html5")
@@ -1,5 +1,6 @@
 
 import re, sys, types
+import unittest
 
 __all__ = ["rfc3986",
            "rfc5234",
@@ -12,6 +13,32 @@ __all__ = ["rfc3986",
            "rfc7234",
            "rfc7235"]
 
+lazy_regexes = [] # every LazyRegex made
+
+class LazyRegex(object):
+    """
+    A regex (usually built from the rules in these modules) that isn't compiled until it's
+    first used. Compiling big patterns is a large part of the cost of importing the modules
+    that use them, and many are never needed by a given process.
+
+    Once compiled, its methods are those of the compiled regex, so it's just as fast.
+    """
+    methods = ['match', 'search', 'findall', 'finditer', 'sub', 'subn', 'split']
+
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
+        lazy_regexes.append(self)
+
+    def __getattr__(self, name):
+        if name not in self.methods:
+            raise AttributeError, name
+        compiled = re.compile(self.pattern, self.flags)
+        for method in self.methods:
+            setattr(self, method, getattr(compiled, method))
+        return getattr(compiled, name)
+
+
 def check_regex():
     """Grab all the regex in this module."""
     for module_name in __all__:
@@ -24,6 +51,21 @@ def check_regex():
                     re.compile(attr_value, re.VERBOSE)
                 except re.error, why:
                     print "*", module_name, attr_name, why.message
+    for lazy_regex in lazy_regexes:
+        try:
+            re.compile(lazy_regex.pattern, lazy_regex.flags)
+        except re.error, why:
+            print "*", lazy_regex.pattern[:40], why.message
+
+
+class LazyRegexTest(unittest.TestCase):
+    def test_lazy(self):
+        lazy = LazyRegex(r"^ a+ $", re.VERBOSE)
+        self.assertFalse(lazy.__dict__.has_key('match'))
+        self.assertTrue(lazy.match("aaa"))
+        self.assertTrue(lazy.__dict__.has_key('match'))
+        self.assertEqual(lazy.findall("b"), [])
+        self.assertRaises(AttributeError, getattr, lazy, 'foo')
 
 
 if __name__ == "__main__":
@@ -10,6 +10,11 @@ These regex are directly derived from the collected ABNF in RFC3986:
 They should be processed with re.VERBOSE.
 """
 
+import random
+import re
+import unittest
+
+from redbot.syntax import LazyRegex
 from rfc5234 import DIGIT, ALPHA, HEXDIG
 
 
@@ -197,6 +202,102 @@ URI_reference = r"(?: {URI} | {relative_ref} )".format(**locals())
 absolute_URI = r"(?: {scheme} : {hier_part} (?: \? {query} )? )".format(**locals())
 
 
+
+### Validation
+
+# Matching URI as written above is slow, because every character goes through several levels
+# of alternation. URI_RE is the same rules flattened into character classes, arranged so that
+# there's only one way to match a given string (so that failing is fast too). The rarer parts
+# (userinfo, and the insides of IP-literals) use the rules above as they are.
+
+def _chars(char_class):
+    "Any number of characters in char_class and pct-encoded octets."
+    return r"{char_class}* (?: {pct_encoded} {char_class}* )*".format(char_class=char_class,
+                                                                      **globals())
+
+REG_NAME_CLASS = r"[A-Za-z0-9\-._~!$&'()*+,;=]"
+PATH_CLASS = r"[A-Za-z0-9\-._~!$&'()*+,;=:@/]"
+QUERY_CLASS = r"[A-Za-z0-9\-._~!$&'()*+,;=:@/?]"
+
+URI_RE = LazyRegex(r"""
+    \s* {ALPHA} [A-Za-z0-9+.\-]* :
+    (?: //
+        (?: {userinfo} @ )?
+        (?: \[ ( [^\]]* ) \] | {reg_name_chars} )
+        (?: : [0-9]* )?
+        (?= [/?\#] | \s | \Z )
+        {path_chars}
+      | (?! // ) (?: (?= {PATH_CLASS} | {pct_encoded} ) {path_chars} | {path_empty} )
+    )
+    (?: \? {query_chars} )?
+    (?: \# {query_chars} )?
+    \s* \Z
+""".format(reg_name_chars=_chars(REG_NAME_CLASS), path_chars=_chars(PATH_CLASS),
+           query_chars=_chars(QUERY_CLASS), **locals()), re.VERBOSE)
+
+IP_LITERAL_RE = LazyRegex(r"(?: {IPv6address} | {IPvFuture} ) \Z".format(**locals()),
+                          re.VERBOSE)
+
+def is_uri(instr):
+    """
+    Return whether instr (with any whitespace around it) matches URI. The answer is the same
+    as the regex's, but it's found much more quickly.
+    """
+    match = URI_RE.match(instr)
+    if match is None:
+        return False
+    literal = match.group(1)
+    return literal is None or IP_LITERAL_RE.match(literal) is not None
+
+
+class IsUriTest(unittest.TestCase):
+    pieces = ["http", "h", "Z", "1", ":", "//", "/", "?", "#", "@", "[", "]", "%", "%4", "%41",
+              "%g1", "%%", ".", "-", "~", "!", "$", "'", "(", "=", ";", "*", "_", " ", "\n",
+              "\x00", "\xff", "{", '"', "\\", "v1.", "::", "255", "256", "01", "1.2.3.4", ":80",
+              "www.example.com", "[::1]", "[v1.x]", "{pchar"]
+    h16s = ["1", "ab", "ffff", "12345", "", "g"]
+    ls32s = ["1.2.3.4", "0.0.0.0", "256.1.1.1", "01.1.1.1", "1.2.3"]
+
+    def uris(self, count):
+        "Generate count URI-ish strings, many of them nearly right."
+        rand = random.Random(3986)
+        for i in xrange(count):
+            uri = "".join([rand.choice(self.pieces) for j in xrange(rand.randint(0, 12))])
+            yield rand.choice(["", "http:", "http://", "a:", "x://u:p@"]) + uri
+            h16s = [rand.choice(self.h16s) for j in xrange(rand.randint(0, 9))]
+            if rand.random() < 0.3:
+                h16s.append(rand.choice(self.ls32s))
+            literal = ":".join(h16s)
+            at = rand.randint(0, len(literal))
+            literal = literal[:at] + rand.choice(["", ":", "::", ":::"]) + literal[at:]
+            yield "http://[%s]%s/" % (literal, rand.choice(["", ":", ":80", "x"]))
+
+    def test_known(self):
+        for uri, expected in [
+            ("http://www.example.com/", True),
+            (" http://www.example.com:80/a-b?c=d/e?#f\n", True),
+            ("HTTP://u@[1:2:3:4:5:6:7:8]:8080", True),
+            ("urn:isbn:0451450523", True),
+            ("http://[v1f.a:b]/", True),
+            ("http://[1:2:3:4:5:6:1.2.3.4]/", True),
+            ("http://www.example.com/a b", False),
+            ("http://www.example.com/%2", False),
+            ("http://www.example.com:8o/", False),
+            ("http://[1:2:3:4:5:6:7:8/", False),
+            ("http://[1::2::3]/", False),
+            ("1http://www.example.com/", False),
+            ("//www.example.com/", False),
+            (u"http://www.example.com/\u00e9", False),
+            ("http://" + "a" * 10000 + " b", False),
+        ]:
+            self.assertEqual(is_uri(uri), expected, uri)
+
+    def test_same_as_regex(self):
+        uri_re = re.compile(r"^\s*%s\s*$" % URI, re.VERBOSE)
+        for uri in self.uris(5000):
+            self.assertEqual(is_uri(uri), bool(uri_re.match(uri)), repr(uri))
+
+
 if __name__ == "__main__":
     import re
     import sys
@@ -56,7 +56,9 @@ class RedWebUi(object):
         self.test_id = None
         self.check_type = None
         self.descend = None
+        self.light = None
         self.save = None
+        self.resource = None
         self.parse_qs(method, query_string)
 
         self.start = time.time()
@@ -183,7 +185,9 @@ class RedWebUi(object):
             ("Content-Type", "%s; charset=%s" % (formatter.media_type, self.config.charset)),
             ("Cache-Control", "max-age=60, must-revalidate")])
 
-        resource = HttpResource(self.test_uri, req_hdrs=self.req_hdrs, descend=self.descend)
+        resource = HttpResource(self.test_uri, req_hdrs=self.req_hdrs, descend=self.descend,
+                                light_links=bool(self.light))
+        self.resource = resource
         resource.on("status", formatter.status)
         resource.response.on("chunk", formatter.feed)
 #        sys.stdout.write(pickle.dumps(resource))
@@ -235,6 +239,7 @@ class RedWebUi(object):
         self.check_type = qs.get('request', [None])[0]
         self.test_id = qs.get('id', [None])[0]
         self.descend = qs.get('descend', [False])[0]
+        self.light = qs.get('light', [False])[0]
         if method == "POST":
             self.save = qs.get('save', [False])[0]
         else:
@@ -245,8 +250,13 @@ class RedWebUi(object):
 
     def timeoutError(self):
         """ Max runtime reached."""
-        self.output(error_template % ("RED timeout."))
-        self.response_done([])
+        self.timeout = None
+        if self.resource:
+            # stop everything and show what we've got; the resource's done handler finishes up.
+            self.resource.cancel(u"it ran for more than %s seconds" % self.config.max_runtime)
+        else:
+            self.output(error_template % ("RED timeout."))
+            self.response_done([])
 
 
     def robots_precheck(self, iri):
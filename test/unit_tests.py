@@ -51,6 +51,24 @@ class GeneralHeaderTesters(unittest.TestCase):
                 "[%s] %s != %s" % (i, str(expected_outlist), str(outlist)))
             i += 1
     
+    def test_parse_date(self):
+        for (instr, expected_date, expected_notes) in [
+            ('Sun, 06 Nov 1994 08:49:37 GMT', 784111777, []),
+            ('Sunday, 06-Nov-94 08:49:37 GMT', 784111777, [headers.DATE_OBSOLETE]),
+            ('Sun Nov  6 08:49:37 1994', 784111777, [headers.DATE_OBSOLETE]),
+            ('sun, 06 nov 1994 08:49:37 gmt', 784111777, []),
+            ('Sun, 06 Nov 1994 08:49:37 PST', None, [headers.BAD_DATE_SYNTAX]),
+            ('Sun, 6 Nov 1994 08:49:37 GMT', None, [headers.BAD_DATE_SYNTAX]),
+        ]:
+            for i in range(2): # the second time, from the memo
+                self.red.__init__()
+                try:
+                    date = headers.parse_date(instr, partial(self.red.add_note, "test"))
+                except ValueError:
+                    date = None
+                self.assertEqual(expected_date, date, "%s: %s" % (instr, date))
+                self.assertEqual([n.__name__ for n in expected_notes], self.red.note_classes)
+
     def test_parse_params(self):
         i = 0
         for (instr, expected_pd, expected_notes, delim) in [